@@ -1,11 +1,36 @@
 import pandas as pd
+import io
 import os
+import time
 import zipfile
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
+import numpy as np
 import geopandas as gpd
 import cdsapi
 import xarray as xr
-import shapefile
+from scipy import sparse
+import shapely
+from shapely import STRtree
+
+# NUTS3 subsets of the NUTS vintages, stored as GeoParquet and kept in memory once loaded
+nuts_cache_dir = "nuts_cache"
+_nuts_vintages = {}
+
+# Cell -> NUTS3 weight matrices, one per NUTS vintage and CAMS grid
+weights_cache_dir = "nuts3_weights"
+_weights = {}
+
+# CDS requests queued at once, processes computing exceedance grids, and the ledger of finished months
+max_requests_in_flight = 4
+process_workers = 4
+ledger_path = "cams_ledger.sqlite"
+
+# Hours per dask chunk of the hourly PM2.5 data
+time_chunk_hours = 24 * 8
 
 
 def filter_nuts_3(years):
@@ -28,74 +53,182 @@ def filter_nuts_3(years):
         "2025": nuts_2021
     }
 
-    nuts = {}
-    for year in years:
-        nuts_name = nuts_names[str(year)]
-        nuts_path = f"{nuts_name}.shp"
-        nuts_filtered = f"{nuts_name}_filtered.shp"
+    # Years of the same vintage share one NutsVintage object
+    return {str(year): load_nuts_vintage(nuts_names[str(year)]) for year in years}
+
+
+class NutsVintage:
+    """NUTS3 regions of one NUTS vintage (EPSG:4326) with an STRtree over their geometries."""
+
+    def __init__(self, name, regions, digest):
+        self.name = name
+        self.regions = regions
+        self.tree = STRtree(regions.geometry.values)
+        self.digest = digest
 
-        filter_shapefile_by_field(nuts_path, nuts_filtered, "LEVL_CODE", 3)
 
-        nuts[str(year)] = nuts_filtered
+def load_nuts_vintage(nuts_name, cache_dir=nuts_cache_dir):
+    """
+    Loads the LEVL_CODE 3 regions of a NUTS vintage once per process.
 
-    return nuts
+    The first load filters {nuts_name}.shp and stores the subset as GeoParquet in cache_dir;
+    later runs read the GeoParquet file unless the shapefile is newer.
 
+    Returns:
+        NutsVintage: The same object for every call with the same nuts_name.
+    """
+    if nuts_name in _nuts_vintages:
+        return _nuts_vintages[nuts_name]
 
-def perform_spatial_analysis(years, months, nuts):
+    nuts_path = f"{nuts_name}.shp"
+    parquet_path = os.path.join(cache_dir, f"{nuts_name}_nuts3.parquet")
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(nuts_path):
+        regions = gpd.read_parquet(parquet_path)
+    else:
+        regions = gpd.read_file(nuts_path)
+        regions = regions[regions["LEVL_CODE"] == 3].reset_index(drop=True)
+        if regions.crs is not None and regions.crs != "EPSG:4326":
+            regions = regions.to_crs("EPSG:4326")
+        os.makedirs(cache_dir, exist_ok=True)
+        regions.to_parquet(parquet_path)
+        print(f"NUTS3 regions of {nuts_name} saved to {parquet_path} ({len(regions)} records)")
+
+    digest = hashlib.sha1()
+    with open(parquet_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _nuts_vintages[nuts_name] = NutsVintage(nuts_name, regions, digest.hexdigest())
+    return _nuts_vintages[nuts_name]
+
+
+def perform_spatial_analysis(years, months, nuts, pm2p5_thresholds=(25,)):
     for year in years:
         for month in months:
-            shapefile_name = get_shapefile_name(year, month)
-            shapefile_path = f"{shapefile_name}.shp"
-            shapefile_projected = f"{shapefile_name}/{shapefile_name}_projected.shp"
+            exceedance_path = f"{get_exceedance_name(year, month, pm2p5_thresholds)}.nc"
+
+            if not os.path.exists(exceedance_path):
+                print(f"No exceedance grid for {year}-{month}, skipping.")
+                continue
+
+            with xr.open_dataarray(exceedance_path) as exceedance:
+                lat_name, lon_name = get_grid_names(exceedance)
+                weights, nuts_ids = cell_weights(nuts[str(year)], exceedance[lat_name].values,
+                                                 exceedance[lon_name].values)
+                summaries = nuts3_means(weights, nuts_ids, exceedance)
+
+            # One summary_stats folder per threshold, each with the usual NUTS_ID / EXCEED_mean CSVs
+            for threshold, summary in summaries.items():
+                summary_dir = get_summary_dir(threshold)
+                os.makedirs(summary_dir, exist_ok=True)
+                output_csv_path = f"{summary_dir}/summary_stats_{year}_{month}.csv"
+                summary.to_csv(output_csv_path)
+                print(f"Summary statistics saved to {output_csv_path}")
 
-            spj_name = f"{shapefile_name}_spj_nuts3"
-            spj_path = f"{spj_name}/{spj_name}.shp"
 
-            output_csv_path = f"summary_stats/summary_stats_{year}_{month}.csv"
+def get_summary_dir(threshold):
+    return f"summary_stats_{threshold:g}"
 
-            os.makedirs(shapefile_name, exist_ok=True)
-            os.makedirs(spj_name, exist_ok=True)
-            os.makedirs("summary_stats", exist_ok=True)
 
-            project_to_epsg(shapefile_path, shapefile_projected)
+def get_threshold_key(pm2p5_thresholds):
+    return "-".join(f"{threshold:g}" for threshold in np.sort(np.atleast_1d(pm2p5_thresholds).astype(float)))
 
-            left_gdf = gpd.read_file(shapefile_projected)
-            right_gdf = gpd.read_file(nuts[str(year)])
 
-            joined_result = spatial_join_geopandas(left_gdf, right_gdf, how='inner', predicate='intersects')
-            joined_result.to_file(spj_path)
+def get_exceedance_name(year, month, pm2p5_thresholds):
+    # The threshold set is part of the name, so runs with other thresholds never overwrite each other
+    return f'cams_exceedance_{year}_{month}_t{get_threshold_key(pm2p5_thresholds)}'
 
-            summarize_shapefile(spj_path, output_csv_path, 'NUTS_ID', ["EXCEED"], ['mean'])
 
+def get_grid_names(xr_data):
+    lat_name = 'lat' if 'lat' in xr_data.coords else 'latitude'
+    lon_name = 'lon' if 'lon' in xr_data.coords else 'longitude'
+    return lat_name, lon_name
 
-def get_shapefile_name(year, month):
-    return f'cams_exceedance_{year}_{month}'
 
+def save_exceedance(exceedance_data, nc_file):
+    """Saves the monthly exceedance grid as a small NetCDF file (variable EXCEED)."""
+    exceedance_data.rename("EXCEED").to_netcdf(nc_file)
 
-def project_to_epsg(shapefile_path, shapefile_projected):
-    gdf = gpd.read_file(shapefile_path)
 
-    if gdf.crs is None:
-        gdf.crs = "EPSG:4326"
-        print("CRS assigned: EPSG:4326")
-        gdf.to_file(shapefile_projected)
+def cell_weights(nuts, lat, lon, cache_dir=weights_cache_dir):
+    """
+    Sparse (NUTS3 x grid cell) matrix averaging the cells whose centre point intersects each
+    NUTS3 region, the same cells the point-in-polygon join used to average.
+
+    Args:
+        nuts (NutsVintage): NUTS3 regions from load_nuts_vintage.
+        lat (numpy.ndarray): Latitudes of the grid.
+        lon (numpy.ndarray): Longitudes of the grid.
+        cache_dir (str): Directory of the cached matrices, keyed by NUTS vintage content and grid.
+
+    Returns:
+        (scipy.sparse.csr_matrix, numpy.ndarray): Weights over the cells in (lat, lon) row-major
+        order, and the NUTS_ID of every row (sorted).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    grid_digest = hashlib.sha1(lat.tobytes() + lon.tobytes()).hexdigest()
+    memo_key = (nuts.digest, grid_digest)
+    if memo_key in _weights:
+        return _weights[memo_key]
+
+    digest = hashlib.sha1(f"{nuts.digest}{grid_digest}".encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{nuts.name}_{digest}.npz")
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as cached:
+            weights = sparse.csr_matrix((cached['data'], cached['indices'], cached['indptr']),
+                                        shape=tuple(cached['shape']))
+            nuts_ids = cached['nuts_ids']
     else:
-        print("Shapefile already has a CRS:", gdf.crs)
+        lon_2d, lat_2d = np.meshgrid(lon, lat)
+        cells = shapely.points(lon_2d.ravel(), lat_2d.ravel())
+        cell_idx, region_idx = nuts.tree.query(cells, predicate='intersects')
+        region_ids = nuts.regions['NUTS_ID'].to_numpy().astype(str)
+        nuts_ids, rows = np.unique(region_ids[region_idx], return_inverse=True)
+        counts = np.bincount(rows, minlength=len(nuts_ids))
+        weights = sparse.csr_matrix((1.0 / counts[rows], (rows, cell_idx)), shape=(len(nuts_ids), lat.size * lon.size))
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name so an interrupted run never leaves a truncated cache
+        with open(cache_path + ".part", 'wb') as f:
+            np.savez(f, data=weights.data, indices=weights.indices, indptr=weights.indptr,
+                     shape=np.array(weights.shape), nuts_ids=nuts_ids)
+        os.replace(cache_path + ".part", cache_path)
+        print(f"Cell weights for {nuts.name} saved to {cache_path}")
+
+    _weights[memo_key] = (weights, nuts_ids)
+    return weights, nuts_ids
+
+
+def nuts3_means(weights, nuts_ids, exceedance_data):
+    """
+    NUTS3 means of an exceedance cube, all thresholds in one sparse product.
+
+    Returns:
+        dict: {threshold: DataFrame with EXCEED_mean per NUTS_ID}.
+    """
+    lat_name, lon_name = get_grid_names(exceedance_data)
+    cube = exceedance_data.transpose('threshold', lat_name, lon_name)
+    means = weights @ cube.values.reshape(cube.sizes['threshold'], -1).T
+    index = pd.Index(nuts_ids, name='NUTS_ID')
+    return {float(threshold): pd.DataFrame({'EXCEED_mean': means[:, i]}, index=index)
+            for i, threshold in enumerate(cube['threshold'].values)}
 
 
-def calculate_exceedance_days_xr(xr_data, pm2p5_threshold, time_dim='time'):
+def calculate_exceedance_days_xr(xr_data, pm2p5_thresholds, time_dim='time'):
     """
     Calculates the number of days in the xarray dataset where the *daily maximum* PM2.5
-    exceeds the given threshold for each grid point, using xarray's temporal aggregation.
+    exceeds each of the given thresholds for each grid point, using xarray's temporal aggregation.
+    The daily maximum is computed once (in dask chunks over time) and compared to all thresholds.
 
     Args:
         xr_data (xr.DataArray or xr.Dataset): The xarray DataArray or Dataset containing PM2.5 data.
-        pm2p5_threshold (float): The PM2.5 threshold value (default: 25).
+        pm2p5_thresholds (float or list of float): The PM2.5 threshold value(s).
         time_dim (str): Name of the time dimension (default: 'time').
 
     Returns:
-        An xarray DataArray with the number of exceedance days for each grid point
-        or None if an error occurs.
+        An xarray DataArray (threshold, lat, lon) with the number of exceedance days for each
+        threshold (sorted ascending) and grid point, or None if an error occurs.
     """
     try:
         if isinstance(xr_data, xr.Dataset):
@@ -103,281 +236,179 @@ def calculate_exceedance_days_xr(xr_data, pm2p5_threshold, time_dim='time'):
         else:
             pm2p5 = xr_data  # Assume it's a DataArray
 
-        # Calculate daily maximum PM2.5 using xarray's resample
-        daily_max = pm2p5.resample({time_dim: 'D'}).max()
+        # Calculate daily maximum PM2.5 using xarray's resample, once for all thresholds
+        daily_max = pm2p5.chunk({time_dim: time_chunk_hours}).resample({time_dim: 'D'}).max()
 
-        # Count the number of days exceeding the threshold
-        exceedance_days = (daily_max > pm2p5_threshold).sum(dim=time_dim)
+        # Count the number of days exceeding every threshold (broadcast over a threshold dimension)
+        thresholds = np.sort(np.atleast_1d(np.asarray(pm2p5_thresholds, dtype=float)))
+        threshold = xr.DataArray(thresholds, dims='threshold', coords={'threshold': thresholds})
+        exceedance_days = (daily_max > threshold).sum(dim=time_dim)
 
-        return exceedance_days
+        return exceedance_days.transpose('threshold', ...)
 
     except Exception as e:
         print(f"Error calculating exceedance days: {e}")
         return None
 
 
-def create_exceedance_shapefile(exceedance_data, lat, lon, shp_file):
-    """Creates a shapefile from the exceedance data."""
-    try:
-        w = shapefile.Writer(shp_file, shapeType=shapefile.POINT)
-        w.field("EXCEED", "N", decimal=0)  # Number of exceedance days (integer)
-        w.field("LAT", "F", decimal=10)
-        w.field("LON", "F", decimal=10)
-
-        for i in range(len(lat)):
-            for j in range(len(lon)):
-                value = exceedance_data[i, j].item()
-                w.point(lon[j], lat[i])
-                w.record(int(value), lat[i], lon[j])  # Convert to integer
+def open_ledger(path=ledger_path):
+    db = sqlite3.connect(path)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS months (
+            dataset TEXT, year TEXT, month TEXT, threshold TEXT, output_path TEXT, processed_at REAL,
+            PRIMARY KEY (dataset, year, month, threshold)
+        )
+    """)
+    db.commit()
+    return db
 
-        w.close()
-        print(f"Successfully created shapefile: {shp_file}")
-        return True
 
-    except Exception as e:
-        print(f"Error creating shapefile: {e}")
-        return False
+def is_done(db, dataset, year, month, threshold):
+    row = db.execute(
+        "SELECT output_path FROM months WHERE dataset = ? AND year = ? AND month = ? AND threshold = ?",
+        (dataset, str(year), str(month), threshold)
+    ).fetchone()
+    return row is not None and os.path.exists(row[0])
 
 
-def summarize_shapefile(input_shapefile, output_csv, group_field, statistics_fields, statistics_types):
-    """
-    Calculates summary statistics for a shapefile, grouped by a specified field,
-    and saves the results to a CSV file.
+def mark_done(db, dataset, year, month, threshold, output_path):
+    db.execute("INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?, ?, ?)",
+               (dataset, str(year), str(month), threshold, output_path, time.time()))
+    db.commit()
 
-    Args:
-        input_shapefile (str): Path to the input shapefile.
-        output_csv (str): Path to the output CSV file.
-        group_field (str): Name of the field to group by.
-        statistics_fields (list): List of field names to calculate statistics for.
-        statistics_types (list): List of statistic types to calculate (e.g., 'mean', 'sum', 'min', 'max', 'std', 'count').
-                                  Must correspond to the order of statistics_fields.
-    """
 
-    try:
-        gdf = gpd.read_file(input_shapefile)
-    except Exception as e:
-        print(f"Error reading shapefile: {e}")
-        return
-
-    if group_field not in gdf.columns:
-        print(f"Error: Group field '{group_field}' not found in shapefile.")
-        return
-
-    if not all(field in gdf.columns for field in statistics_fields):
-        missing_fields = [field for field in statistics_fields if field not in gdf.columns]
-        print(f"Error: Statistics fields {missing_fields} not found in shapefile.")
-        return
-
-    if len(statistics_fields) != len(statistics_types):
-        print("Error: The number of statistics fields and statistics types must match.")
-        return
-
-    grouped = gdf.groupby(group_field)
-    results = {}
-
-    for i, field in enumerate(statistics_fields):
-        stat_type = statistics_types[i]
-        try:
-
-            if stat_type == 'count':
-                results[f'{field}_count'] = grouped[field].count()
-            elif stat_type == 'mean':
-                results[f'{field}_mean'] = grouped[field].mean()
-            elif stat_type == 'sum':
-                results[f'{field}_sum'] = grouped[field].sum()
-            elif stat_type == 'min':
-                results[f'{field}_min'] = grouped[field].min()
-            elif stat_type == 'max':
-                results[f'{field}_max'] = grouped[field].max()
-            elif stat_type == 'std':
-                results[f'{field}_std'] = grouped[field].std()
-            elif stat_type == 'median':
-                results[f'{field}_median'] = grouped[field].median()
-            elif stat_type == 'var':
-                results[f'{field}_var'] = grouped[field].var()
-            else:
-                print(f"Warning: Statistic type '{stat_type}' not supported. Skipping field '{field}'.")
-                continue
-        except Exception as e:
-            print(f"Error calculating {stat_type} for field {field}: {e}")
-            continue
+def build_request(dataset, year, month):
+    request = {
+        "variable": ["particulate_matter_2.5um"],
+        "model": ["ensemble"],
+        "level": ["0"]
+    }
 
-    result_df = pd.DataFrame(results)
-    result_df.to_csv(output_csv)
-    print(f"Summary statistics saved to {output_csv}")
+    if 'forecasts' in dataset:
+        start_date = f"{year}-{int(month):02}-01"
+        end_year = int(year) + 1 if int(month) == 12 else year
+        end_month = 1 if int(month) == 12 else int(month) + 1
+        end_date = f"{end_year}-{end_month:02}-01"
+
+        request.update({
+            "date": [f"{start_date}/{end_date}"],
+            "type": ["analysis"],
+            "time": [f"{hour:02}:00" for hour in range(24)],
+            "leadtime_hour": ["0"],
+            "data_format": "netcdf_zip"
+        })
 
+    else:
+        request.update({
+            "year": year,
+            "month": month,
+            "type": ["validated_reanalysis"]
+        })
 
-def spatial_join_geopandas(left_gdf, right_gdf, how='inner', predicate='intersects'):
-    """
-    Performs a spatial join using geopandas.
+    return request
 
-    Args:
-        left_gdf (geopandas.GeoDataFrame): Left GeoDataFrame.
-        right_gdf (geopandas.GeoDataFrame): Right GeoDataFrame.
-        how (str, optional): Type of join ('left', 'right', 'inner'). Defaults to 'inner'.
-        predicate (str, optional): Spatial predicate ('intersects', 'contains', 'within', etc.). Defaults to 'intersects'.
 
-    Returns:
-        geopandas.GeoDataFrame: Joined GeoDataFrame.
+def process_month(zip_file, nc_file, pm2p5_thresholds):
     """
-    try:
-        joined_gdf = gpd.sjoin(left_gdf, right_gdf, how=how, predicate=predicate)
-        return joined_gdf
-    except Exception as e:
-        print(f"Error during spatial join: {e}")
-        return None
-
+    Computes and saves the exceedance grid of one downloaded month (runs in a worker process).
 
-def filter_shapefile_by_field(input_shapefile, output_shapefile, field_name, field_value):
+    The NetCDF member is opened straight from the zip archive: stored members are read in place,
+    compressed ones are inflated in memory, so nothing is extracted to disk.
     """
-    Filters a shapefile based on a specific field value and exports it as a new shapefile.
+    with zipfile.ZipFile(zip_file) as archive:
+        name = next((name for name in archive.namelist() if name.endswith(".nc")), None)
+        if name is None:
+            raise ValueError(f"No NetCDF file found in {zip_file}")
 
-    Args:
-        input_shapefile (str): Path to the input shapefile.
-        output_shapefile (str): Path to save the filtered shapefile.
-        field_name (str): Name of the field to filter by.
-        field_value (any): Value to filter the field by.
-    """
-    try:
-        gdf = gpd.read_file(input_shapefile)
-
-        filtered_gdf = gdf[gdf[field_name] == field_value]
-
-        filtered_gdf.to_file(output_shapefile)
-
-        print(f"Filtered shapefile saved to: {output_shapefile}")
-        print(f"Number of filtered records: {len(filtered_gdf)}")
+        with archive.open(name) as member:
+            source = member if archive.getinfo(name).compress_type == zipfile.ZIP_STORED else io.BytesIO(member.read())
+            with xr.open_dataset(source) as xr_dataset:
+                monthly_exceedance = calculate_exceedance_days_xr(xr_dataset, pm2p5_thresholds)
+                if monthly_exceedance is None:
+                    raise ValueError(f"Could not calculate exceedance days from {zip_file}")
+                save_exceedance(monthly_exceedance.load(), nc_file + ".part")
 
-    except FileNotFoundError:
-        print(f"Error: Input shapefile not found at {input_shapefile}")
-    except KeyError:
-        print(f"Error: Field '{field_name}' not found in the shapefile.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+    os.replace(nc_file + ".part", nc_file)
+    return nc_file
 
 
-def extract_zip(zip_file_path, extract_to_path=None):
-    """Extracts a zip archive safely."""
-    try:
-        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-            if extract_to_path is None:
-                base_name = os.path.basename(zip_file_path)
-                extract_to_path = os.path.splitext(base_name)[0]
-                extract_to_path = os.path.join(os.path.dirname(zip_file_path), extract_to_path)
-            os.makedirs(extract_to_path, exist_ok=True)
-            zip_ref.extractall(extract_to_path)
-        return extract_to_path  # Return the extraction path for later use
-
-    except (FileNotFoundError, zipfile.BadZipFile, Exception) as e:
-        print(f"Error extracting {zip_file_path}: {e}")
-        return None
+def get_cams_data(years, months, dataset, pm2p5_thresholds=(25,), client_factory=cdsapi.Client,
+                  requests_in_flight=None, workers=None, ledger=ledger_path):
+    """
+    Retrieves CAMS PM2.5 data for every (year, month) and saves its monthly exceedance grid.
 
+    Up to requests_in_flight CDS requests are queued at once. Every finished download is handed to a
+    process pool running calculate_exceedance_days_xr while later requests are still waiting in the
+    CDS queue. Months recorded in the ledger (whose grid is still on disk) are skipped on reruns.
 
-def get_cams_data(years, months, dataset, pm2p5_threshold=25):
-    if 'forecasts' in dataset:
-        forecasts = True
-    elif 'reanalyses' in dataset:
-        forecasts = False
-    else:
+    Args:
+        client_factory (callable): Builds one client per retrieval thread; anything with
+            retrieve(dataset, request).download(path), e.g. a local fake of cdsapi.Client.
+    """
+    if 'forecasts' not in dataset and 'reanalyses' not in dataset:
         raise ValueError("Invalid dataset type. Must be either 'forecasts' or 'reanalyses'.")
 
-    client = cdsapi.Client()
-
+    requests_in_flight = requests_in_flight or max_requests_in_flight
+    workers = workers or process_workers
+    threshold_key = get_threshold_key(pm2p5_thresholds)
+    db = open_ledger(ledger)
+    local = threading.local()
+
+    def retrieve(year, month):
+        zip_file = f"cams_data_{year}_{month}.zip"
+        # A zip left by an interrupted run was fully downloaded (it is renamed only when complete)
+        if not os.path.exists(zip_file):
+            if not hasattr(local, "client"):
+                local.client = client_factory()
+            result = local.client.retrieve(dataset, build_request(dataset, year, month))
+            result.download(zip_file + ".part")
+            os.replace(zip_file + ".part", zip_file)
+        return zip_file
+
+    todo = []
     for year in years:
-
         for month in months:
-            request = {
-                "variable": ["particulate_matter_2.5um"],
-                "model": ["ensemble"],
-                "level": ["0"]
-            }
-
-            if forecasts:
-                start_date = f"{year}-{month:02}-01"
-                end_year = int(year) + 1 if month == 12 else year
-                end_month = 1 if month == 12 else int(month) + 1
-                end_date = f"{end_year}-{end_month:02}-01"
-
-                request.update({
-                    "date": [f"{start_date}/{end_date}"],
-                    "type": ["analysis"],
-                    "time": [f"{hour:02}:00" for hour in range(24)],
-                    "leadtime_hour": ["0"],
-                    "data_format": "netcdf_zip"
-                })
-
+            if is_done(db, dataset, year, month, threshold_key):
+                print(f"Skipping {year}-{month}, already processed.")
             else:
-                request.update({
-                    "year": year,
-                    "month": month,
-                    "type": ["validated_reanalysis"]
-                })
-
-            try:
-                result = client.retrieve(dataset, request)
-                zip_file = f"cams_data_{year}_{month}.zip"
-                result.download(zip_file)
-
-                extraction_path = extract_zip(zip_file)
-                if extraction_path:
-                    netcdf_file = None
-                    for filename in os.listdir(extraction_path):
-                        if filename.endswith(".nc"):
-                            netcdf_file = os.path.join(extraction_path, filename)
-                            break
-
-                    if netcdf_file:
-                        try:
-                            xr_dataset = xr.open_dataset(netcdf_file)
-
-                            monthly_exceedance = calculate_exceedance_days_xr(xr_dataset, pm2p5_threshold)
-
-                            if monthly_exceedance is not None:
-                                shp_file = f"{get_shapefile_name(year, month)}.shp"
-                                try:
-                                    lat = xr_dataset['lat'].values if 'lat' in xr_dataset else xr_dataset[
-                                        'latitude'].values
-                                    lon = xr_dataset['lon'].values if 'lon' in xr_dataset else xr_dataset[
-                                        'longitude'].values
-                                    if create_exceedance_shapefile(monthly_exceedance, lat, lon, shp_file):
-                                        print(f"Monthly exceedance shapefile successfully created at {shp_file}")
-                                    else:
-                                        print("Failed to create monthly exceedance shapefile.")
-                                except Exception as e:
-                                    print(f"Error creating monthly exceedance shapefile: {e}")
-
-                        except Exception as e:
-                            print(f"Error processing NetCDF file for {year}-{month} with xarray: {e}")
-                        finally:
-                            if 'xr_dataset' in locals():
-                                xr_dataset.close()
-                                del xr_dataset  # Explicitly delete
-
-                    else:
-                        print(f"No NetCDF file found in the extracted zip archive for {year}-{month}.")
-
-                # Cleanup extracted files and zip archive
-                if extraction_path and os.path.exists(extraction_path):
-                    import shutil
-                    shutil.rmtree(extraction_path)
-                if os.path.exists(zip_file):
-                    os.remove(zip_file)
-            except Exception as e:
-                print(f"Error retrieving data for {year}-{month}: {e}")
+                todo.append((year, month))
+
+    with ThreadPoolExecutor(max_workers=requests_in_flight) as downloads, \
+            ProcessPoolExecutor(max_workers=workers) as processes:
+        pending = {downloads.submit(retrieve, year, month): ("retrieving", year, month) for year, month in todo}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, year, month = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error {stage} data for {year}-{month}: {e}")
+                    continue
+
+                if stage == "retrieving":
+                    nc_file = f"{get_exceedance_name(year, month, pm2p5_thresholds)}.nc"
+                    pending[processes.submit(process_month, result, nc_file, pm2p5_thresholds)] = ("processing", year, month)
+                else:
+                    mark_done(db, dataset, year, month, threshold_key, result)
+                    os.remove(f"cams_data_{year}_{month}.zip")
+                    print(f"Monthly exceedance grid successfully saved at {result}")
+
+    db.close()
 
 
 def main():
-    pm2p5_threshold = 5
+    pm2p5_thresholds = [5, 15, 25]
     years = ["2013", "2014", "2015", "2016", "2017", "2018", "2019", "2020", "2021", "2022"]
     months = ["01", "02", "03", "04", "05", "06", "07", "08", "09", "10", "11", "12"]
     dataset = "cams-europe-air-quality-reanalyses"
     # dataset = "cams-europe-air-quality-forecasts"
 
-    get_cams_data(years, months, dataset, pm2p5_threshold)
+    get_cams_data(years, months, dataset, pm2p5_thresholds)
 
     nuts = filter_nuts_3(years)
 
-    perform_spatial_analysis(years, months, nuts)
+    perform_spatial_analysis(years, months, nuts, pm2p5_thresholds)
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ from routes.drought_index import drought_index_bp
 from routes.forecasts import forecasts_bp
 from routes.spacial_analysis import spacial_analysis_bp
 from routes.tasmi import tasmi_bp
+from routes.tiles import tiles_bp
 
 app = Flask(__name__)
 
@@ -19,6 +20,7 @@ app.register_blueprint(drought_index_bp)
 app.register_blueprint(forecasts_bp)
 app.register_blueprint(spacial_analysis_bp)
 app.register_blueprint(tasmi_bp)
+app.register_blueprint(tiles_bp)
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=8091)
@@ -0,0 +1,188 @@
+# crop_suitability.py
+"""Vectorized crop suitability over the temperature and soil moisture cubes.
+
+Every crop's temperature and soil moisture window is evaluated in one
+broadcast comparison over (crop x period x cell). The result is stored next
+to the other layers of the grid store:
+
+    {root}/crop_suitability/{CC}/grid.parquet         cells shared by both layers
+    {root}/crop_suitability/{CC}/values.parquet       year, month, mean_temp, mean_moisture
+    {root}/crop_suitability/{CC}/suitability.parquet  crop, year, month, packed cell bitmask
+    {root}/crop_suitability/{CC}/availability.json    {crop: {year: [months]}}
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from . import grid_store  # imported by the dashboard as processing.crop_suitability
+except ImportError:
+    import grid_store
+
+VARIABLE = "crop_suitability"
+
+# Define crop conditions with extended planting months and temperature ranges
+CROP_CONDITIONS = {
+    "Winter Wheat": {"planting_month": "09-11", "temp_range": (5, 10)},
+    "Spring Wheat": {"planting_month": "03-05", "temp_range": (7, 12)},
+    "Winter Barley": {"planting_month": "09-11", "temp_range": (5, 10)},
+    "Spring Barley": {"planting_month": "03-04", "temp_range": (7, 12)},
+    "Maize": {"planting_month": "05-06", "temp_range": (13, 18)},
+    "Sunflower": {"planting_month": "05-06", "temp_range": (15, 20)},
+    "Potato": {"planting_month": "03-05", "temp_range": (7, 12)},
+    "Rapeseed": {"planting_month": "08-09", "temp_range": (5, 10)},
+    "Sugar Beet": {"planting_month": "03-05", "temp_range": (7, 12)},
+    "Peas": {"planting_month": "03-05", "temp_range": (5, 10)}
+}
+
+# Define ideal soil moisture range for each crop (in % VWC)
+IDEAL_SOIL_HUMIDITY = {
+    "Winter Wheat": (20, 25),
+    "Spring Wheat": (20, 25),
+    "Winter Barley": (20, 25),
+    "Spring Barley": (20, 25),
+    "Maize": (25, 30),
+    "Sunflower": (25, 30),
+    "Potato": (25, 30),
+    "Rapeseed": (20, 25),
+    "Sugar Beet": (20, 25),
+    "Peas": (20, 25)
+}
+
+
+def planting_months(planting_value):
+    """Months of a planting window, e.g. "09-11" -> [9, 10, 11]."""
+    if "-" in planting_value:
+        start, end = planting_value.split("-")
+        return list(range(int(start), int(end) + 1))
+    return [int(planting_value)]
+
+
+def _align_cubes(temp_grid, temp_periods, temp_vals, moist_grid, moist_periods, moist_vals):
+    # Cells are matched on grid_id and periods on (year, month), as an inner join
+    ids, temp_cells, moist_cells = np.intersect1d(
+        temp_grid["grid_id"].to_numpy(), moist_grid["grid_id"].to_numpy(), return_indices=True
+    )
+    temp_keys = (temp_periods["year"] * 100 + temp_periods["month"]).to_numpy()
+    moist_keys = (moist_periods["year"] * 100 + moist_periods["month"]).to_numpy()
+    keys, temp_rows, moist_rows = np.intersect1d(temp_keys, moist_keys, return_indices=True)
+
+    grid = temp_grid.iloc[temp_cells][["grid_id", "geometry"]].reset_index(drop=True)
+    periods = pd.DataFrame({"year": keys // 100, "month": keys % 100})
+    temp = temp_vals[np.ix_(temp_rows, temp_cells)]
+    moist = moist_vals[np.ix_(moist_rows, moist_cells)]
+    return grid, periods, temp, moist
+
+
+def evaluate(temp, moist, months, crops=None):
+    """Boolean (crop x period x cell) array of cells meeting each crop's window.
+
+    ``temp`` and ``moist`` are aligned (period x cell) arrays and ``months``
+    the month of every period; periods outside a crop's planting window are
+    never suitable.
+    """
+    crops = list(CROP_CONDITIONS) if crops is None else crops
+    temp_range = np.array([CROP_CONDITIONS[c]["temp_range"] for c in crops], dtype=float)
+    moist_range = np.array([IDEAL_SOIL_HUMIDITY[c] for c in crops], dtype=float)
+    in_season = np.array([np.isin(months, planting_months(CROP_CONDITIONS[c]["planting_month"]))
+                          for c in crops])
+
+    t = temp[None, :, :]
+    m = moist[None, :, :]
+    return (
+        (t >= temp_range[:, 0, None, None]) & (t <= temp_range[:, 1, None, None])
+        & (m >= moist_range[:, 0, None, None]) & (m <= moist_range[:, 1, None, None])
+        & in_season[:, :, None]
+    )
+
+
+def build_suitability(root, country_code, temp_variable="lst", moisture_variable="soil_moisture"):
+    """Evaluate every crop for a country and write the suitability layer."""
+    temp_grid = grid_store.read_grid(root, temp_variable, country_code)
+    moist_grid = grid_store.read_grid(root, moisture_variable, country_code)
+    temp_periods, temp_vals = grid_store.read_cube(root, temp_variable, country_code)
+    moist_periods, moist_vals = grid_store.read_cube(root, moisture_variable, country_code)
+
+    grid, periods, temp, moist = _align_cubes(
+        temp_grid, temp_periods, temp_vals, moist_grid, moist_periods, moist_vals
+    )
+    crops = list(CROP_CONDITIONS)
+    suitable = evaluate(temp, moist, periods["month"].to_numpy(), crops)
+
+    directory = grid_store.store_dir(root, VARIABLE, country_code)
+    os.makedirs(directory, exist_ok=True)
+    grid.to_parquet(os.path.join(directory, "grid.parquet"), index=False)
+
+    n_cells = len(grid)
+    pq.write_table(
+        pa.table({
+            "year": np.repeat(periods["year"].to_numpy().astype(np.int16), n_cells),
+            "month": np.repeat(periods["month"].to_numpy().astype(np.int8), n_cells),
+            "mean_temp": temp.astype(np.float32).ravel(),
+            "mean_moisture": moist.astype(np.float32).ravel(),
+        }),
+        os.path.join(directory, "values.parquet"),
+        row_group_size=max(n_cells, 1),
+        compression="zstd",
+    )
+
+    # One packed bitmask per (crop, period) with at least one suitable cell
+    crop_idx, period_idx = np.nonzero(suitable.any(axis=2))
+    pq.write_table(
+        pa.table({
+            "crop": [crops[c] for c in crop_idx],
+            "year": periods["year"].to_numpy()[period_idx].astype(np.int16),
+            "month": periods["month"].to_numpy()[period_idx].astype(np.int8),
+            "mask": [np.packbits(suitable[c, p]).tobytes() for c, p in zip(crop_idx, period_idx)],
+        }, schema=pa.schema([("crop", pa.string()), ("year", pa.int16()),
+                             ("month", pa.int8()), ("mask", pa.binary())])),
+        os.path.join(directory, "suitability.parquet"),
+    )
+
+    availability = {}
+    for c, p in zip(crop_idx, period_idx):
+        year = str(periods["year"].iloc[p])
+        availability.setdefault(crops[c], {}).setdefault(year, []).append(f"{periods['month'].iloc[p]:02d}")
+    with open(os.path.join(directory, "availability.json"), "w") as f:
+        json.dump(availability, f, indent=1)
+
+    # Sidecar for map centring (no single value to summarise)
+    grid_store.write_metadata(
+        os.path.join(directory, "meta.json"), grid_store.grid_metadata(grid, np.full(n_cells, np.nan))
+    )
+    return availability
+
+
+def read_availability(root, country_code):
+    """{crop: {year: [months]}} of crops with suitable cells, or None if not built."""
+    path = os.path.join(grid_store.store_dir(root, VARIABLE, country_code), "availability.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_suitable_cells(root, country_code, crop, year, month):
+    """GeoDataFrame of the cells suitable for ``crop`` in one period (None if there are none)."""
+    directory = grid_store.store_dir(root, VARIABLE, country_code)
+    filters = [("crop", "==", crop), ("year", "==", int(year)), ("month", "==", int(month))]
+    masks = pq.read_table(os.path.join(directory, "suitability.parquet"), columns=["mask"], filters=filters)
+    if not masks.num_rows:
+        return None
+
+    grid = gpd.read_parquet(os.path.join(directory, "grid.parquet"))
+    values = pq.read_table(
+        os.path.join(directory, "values.parquet"),
+        columns=["mean_temp", "mean_moisture"],
+        filters=filters[1:],
+    ).to_pandas()
+    mask = np.unpackbits(np.frombuffer(masks.column("mask")[0].as_py(), dtype=np.uint8))[:len(grid)].astype(bool)
+
+    grid["mean_temp"] = values["mean_temp"].to_numpy()
+    grid["mean_moisture"] = values["mean_moisture"].to_numpy()
+    return grid[mask].reset_index(drop=True)
@@ -0,0 +1,56 @@
+# geojson_to_store.py
+# One-off migration of the per-month GeoJSON outputs into the columnar grid store.
+import glob
+import os
+import re
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+import grid_store
+
+# (store variable, legacy directory, filename prefix, value column, store variable of the undated file)
+legacy_layers = [
+    ("lst", "../lts", "grid_aggregated", "mean_val", "lst_mean"),
+    ("air_temperature", "../temperature", "grid_aggregated", "mean_val", None),
+    ("soil_moisture", "../moisture_new", "grid_soil_moisture", "mean_val", None),
+    ("tasmi", "../tasmi", "grid_aggregated", "mean_tasmi", None),
+    ("drought_stress", "../drought_stress", "grid_aggregated", "mean_val", None),
+]
+country_codes = ["LT", "PL"]
+
+period_pattern = re.compile(r"_(\d{4})_(\d{2})\.geojson$")
+
+
+def migrate(files, variable, country_code, column, periods=None):
+    # The grid geometry is identical in every file, so keep the first one only
+    grid = gpd.read_file(files[0])[["grid_id", "geometry"]]
+    mean_vals = np.full((len(files), len(grid)), np.nan)
+    for i, filename in enumerate(files):
+        gdf = gpd.read_file(filename, ignore_geometry=True)
+        mean_vals[i] = grid["grid_id"].map(gdf.set_index("grid_id")[column]).to_numpy()
+    grid_store.write_store("../store", variable, country_code, grid, mean_vals, periods, column=column)
+    print(f"Migrated {len(files)} file(s) to ../store/{variable}/{country_code}.")
+
+
+for variable, directory, prefix, column, undated_variable in legacy_layers:
+    for country_code in country_codes:
+        dated, undated = [], []
+        for filename in sorted(glob.glob(os.path.join(directory, f"{prefix}_{country_code}*.geojson"))):
+            match = period_pattern.search(filename)
+            if match:
+                dated.append((int(match.group(1)), int(match.group(2)), filename))
+            elif os.path.basename(filename) == f"{prefix}_{country_code}.geojson":
+                undated.append(filename)
+
+        if dated:
+            periods = pd.DataFrame([(y, m) for y, m, _ in dated], columns=["year", "month"])
+            migrate([filename for _, _, filename in dated], variable, country_code, column, periods)
+            # The undated file next to the monthly ones is a separate layer (e.g. the LST mean)
+            if undated and undated_variable:
+                migrate(undated, undated_variable, country_code, column)
+        elif undated:
+            migrate(undated, variable, country_code, column)
+
+print("Migration complete.")
@@ -0,0 +1,201 @@
+# grid_store.py
+"""Columnar storage for the precomputed grids.
+
+Each (variable, country) pair is a directory holding the grid geometry once
+and the per-period values as a compact Parquet column:
+
+    {root}/{variable}/{CC}/grid.parquet    grid_id + clipped cell geometry
+    {root}/{variable}/{CC}/values.parquet  year, month, <value column>
+    {root}/{variable}/{CC}/meta.json       bounds, centroid, cell count, value stats
+
+The values are written period-major with one row group per period, in the
+same row order as grid.parquet, so reading a single month only touches that
+row group.
+"""
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def store_dir(root, variable, country_code):
+    return os.path.join(root, variable, country_code.upper())
+
+
+def has_store(root, variable, country_code):
+    directory = store_dir(root, variable, country_code)
+    return (os.path.exists(os.path.join(directory, "grid.parquet"))
+            and os.path.exists(os.path.join(directory, "values.parquet")))
+
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def period_label(year=None, month=None):
+    """Key of a period in the metadata ("YYYY-MM", or "all" without a time axis)."""
+    if year is None:
+        return "all"
+    return f"{int(year)}-{int(month):02d}"
+
+
+def _value_stats(values):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return None
+    return {
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "quantiles": {str(q): float(v) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES))},
+    }
+
+
+def grid_metadata(grid, mean_vals, periods=None):
+    """Bounds, centroid, cell count and per-period value statistics of a grid.
+
+    Lets the dashboard centre the map and scale the legend without loading
+    or unioning the geometry.
+    """
+    try:
+        outline = grid.geometry.union_all()
+    except AttributeError:
+        outline = grid.unary_union
+    centroid = outline.centroid if not grid.empty else None
+
+    mean_vals = np.asarray(mean_vals, dtype=float).reshape(-1, len(grid))
+    if periods is None:
+        labels = [period_label()]
+    else:
+        labels = [period_label(y, m) for y, m in zip(periods["year"], periods["month"])]
+
+    return {
+        "cell_count": int(len(grid)),
+        "bounds": [float(v) for v in grid.total_bounds] if not grid.empty else None,
+        "centroid": [centroid.y, centroid.x] if centroid is not None else [0, 0],
+        "periods": {label: _value_stats(row) for label, row in zip(labels, mean_vals)},
+    }
+
+
+def write_metadata(path, metadata):
+    with open(path, "w") as f:
+        json.dump(metadata, f, indent=1)
+
+
+def read_metadata(path):
+    """Metadata sidecar at ``path``, or None if it has not been written."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def metadata_path(root, variable, country_code):
+    return os.path.join(store_dir(root, variable, country_code), "meta.json")
+
+
+def write_store(root, variable, country_code, grid, mean_vals, periods=None, column="mean_val"):
+    """Write the grid geometry and a (period x cell) value array.
+
+    ``periods`` is a frame with ``year`` and ``month`` columns, one row per
+    row of ``mean_vals``; leave it out for layers without a time axis.
+    """
+    directory = store_dir(root, variable, country_code)
+    os.makedirs(directory, exist_ok=True)
+
+    grid = grid[["grid_id", "geometry"]].reset_index(drop=True)
+    mean_vals = np.asarray(mean_vals, dtype=np.float32).reshape(-1, len(grid))
+    n_cells = len(grid)
+    if periods is not None and len(periods) != mean_vals.shape[0]:
+        raise ValueError(f"{len(periods)} periods given for {mean_vals.shape[0]} rows of values")
+    elif periods is None and mean_vals.shape[0] != 1:
+        raise ValueError(f"{mean_vals.shape[0]} rows of values given without periods")
+
+    columns = {}
+    if periods is not None:
+        columns["year"] = np.repeat(periods["year"].to_numpy().astype(np.int16), n_cells)
+        columns["month"] = np.repeat(periods["month"].to_numpy().astype(np.int8), n_cells)
+    columns[column] = mean_vals.ravel()
+
+    # Write everything under temporary names first and swap the grid in last,
+    # so readers never see a grid next to values of a different build
+    paths = {
+        "values": os.path.join(directory, "values.parquet"),
+        "meta": metadata_path(root, variable, country_code),
+        "grid": os.path.join(directory, "grid.parquet"),
+    }
+    partial = {name: path + ".part" for name, path in paths.items()}
+    try:
+        pq.write_table(
+            pa.table(columns),
+            partial["values"],
+            row_group_size=max(n_cells, 1),
+            compression="zstd",
+        )
+        write_metadata(partial["meta"], grid_metadata(grid, mean_vals, periods))
+        grid.to_parquet(partial["grid"], index=False)
+        for name in ("values", "meta", "grid"):
+            os.replace(partial[name], paths[name])
+    finally:
+        for path in partial.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def read_grid(root, variable, country_code):
+    return gpd.read_parquet(os.path.join(store_dir(root, variable, country_code), "grid.parquet"))
+
+
+def read_values(root, variable, country_code, year=None, month=None, column="mean_val"):
+    """Values of one period in grid row order (all periods if ``year`` is None)."""
+    filters = None
+    if year is not None:
+        filters = [("year", "==", int(year)), ("month", "==", int(month))]
+    table = pq.read_table(
+        os.path.join(store_dir(root, variable, country_code), "values.parquet"),
+        columns=[column],
+        filters=filters,
+    )
+    return table.column(column).to_numpy()
+
+
+def read_cube(root, variable, country_code, column="mean_val"):
+    """All stored periods as ``(periods, values)`` with a (period x cell) array."""
+    table = pq.read_table(
+        os.path.join(store_dir(root, variable, country_code), "values.parquet"),
+        columns=["year", "month", column],
+    )
+    year = table.column("year").to_numpy().astype(np.int64)
+    month = table.column("month").to_numpy().astype(np.int64)
+    codes, first = np.unique(year * 100 + month, return_index=True)
+    order = np.argsort(year * 100 + month, kind="stable")
+    values = table.column(column).to_numpy()[order].reshape(len(codes), -1)
+    periods = pd.DataFrame({"year": year[first], "month": month[first]})
+    return periods, values
+
+
+def available_periods(root, variable, country_code):
+    """Sorted (year, month) pairs stored for a variable and country."""
+    if not has_store(root, variable, country_code):
+        return []
+    table = pq.read_table(
+        os.path.join(store_dir(root, variable, country_code), "values.parquet"),
+        columns=["year", "month"],
+    )
+    periods = table.to_pandas().drop_duplicates()
+    return sorted((int(y), int(m)) for y, m in periods.itertuples(index=False))
+
+
+def read_period(root, variable, country_code, year=None, month=None, column="mean_val"):
+    """GeoDataFrame of one period, or None if it is not in the store."""
+    if not has_store(root, variable, country_code):
+        return None
+    values = read_values(root, variable, country_code, year, month, column)
+    grid = read_grid(root, variable, country_code)
+    if len(values) != len(grid):
+        return None
+    grid[column] = values
+    return grid
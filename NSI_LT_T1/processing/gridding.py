@@ -0,0 +1,327 @@
+# gridding.py
+"""Vectorized gridding shared by the precompute scripts.
+
+Instead of building a shapely Point for every NetCDF cell and spatially
+joining it to the grid, the coordinate axes are binned straight into the
+regular grid with integer arithmetic.  The country mask is evaluated once
+on the coordinate axes and reused for every time slice.  Large inputs can
+be streamed block by block from a lazily opened dataset.
+"""
+import hashlib
+import os
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import scipy.spatial  # for nearest-neighbor interpolation
+import shapely
+
+
+def load_country_polygons(nuts_path, country_codes):
+    """Read the NUTS shapefile once and return {country code: outline in EPSG:4326}."""
+    nuts = gpd.read_file(nuts_path).to_crs(epsg=4326)
+    polygons = {}
+    for country_code in country_codes:
+        country_gdf = nuts[nuts["CNTR_CODE"] == country_code]
+        # Use union_all() if available, else fallback to unary_union.
+        try:
+            polygons[country_code] = country_gdf.geometry.union_all()
+        except AttributeError:
+            polygons[country_code] = country_gdf.unary_union
+    return polygons
+
+
+def load_country_polygon(nuts_path, country_code):
+    """Read the NUTS shapefile and return the country outline in EPSG:4326."""
+    return load_country_polygons(nuts_path, [country_code])[country_code]
+
+
+def stack_coords(da, x_name, y_name, time_name=None):
+    """Point coordinates and slice labels of a DataArray, without reading its values.
+
+    Returns ``lon`` and ``lat`` (one entry per point, in (y, x) order) and a
+    ``slices`` frame with one row per combination of the non-spatial
+    dimensions. When ``time_name`` is given, ``year`` and ``month`` columns
+    are derived from it.
+    """
+    other_dims = [d for d in da.dims if d not in (x_name, y_name)]
+    da = da.transpose(*other_dims, y_name, x_name)
+
+    lon, lat = np.meshgrid(da[x_name].values.astype(float), da[y_name].values.astype(float))
+
+    if other_dims:
+        slices = (
+            da.isel({x_name: 0, y_name: 0}, drop=True)
+            .to_dataframe(name="_value")
+            .reset_index()
+            .drop(columns="_value")
+        )
+    else:
+        slices = pd.DataFrame(index=pd.RangeIndex(1))
+
+    if time_name is not None:
+        time = pd.to_datetime(slices[time_name])
+        slices["year"] = time.dt.year
+        slices["month"] = time.dt.month
+
+    return lon.ravel(), lat.ravel(), slices
+
+
+def stack_points(da, x_name, y_name, time_name=None):
+    """Flatten a DataArray into in-memory (slices x points) values.
+
+    Same as ``stack_coords`` plus ``values`` with one row per slice; use
+    ``stream_aggregate_periods`` for inputs that do not fit in memory.
+    """
+    lon, lat, slices = stack_coords(da, x_name, y_name, time_name)
+    other_dims = [d for d in da.dims if d not in (x_name, y_name)]
+    values = np.asarray(da.transpose(*other_dims, y_name, x_name).values, dtype=float)
+    return lon, lat, values.reshape(-1, lon.size), slices
+
+
+def _load_cached(path):
+    """Array cached at ``path``, or None if missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return np.load(path)
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def _save_cached(path, array):
+    """Save ``array`` to ``path`` atomically.
+
+    Several precompute workers share a cache directory, so the array is
+    written to a temporary file next to ``path`` and renamed into place.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def country_mask(lon, lat, country_polygon, cache_dir=None):
+    """Boolean mask of the points lying within the country polygon.
+
+    With ``cache_dir`` the mask is stored as ``mask_<hash>.npy``, keyed on
+    the polygon and the point coordinates, so inputs sharing a raster grid
+    only test their points against the polygon once.
+    """
+    if cache_dir is not None:
+        key = hashlib.sha1()
+        key.update(shapely.to_wkb(country_polygon))
+        key.update(np.ascontiguousarray(lon, dtype=float).tobytes())
+        key.update(np.ascontiguousarray(lat, dtype=float).tobytes())
+        path = os.path.join(cache_dir, f"mask_{key.hexdigest()[:16]}.npy")
+        mask = _load_cached(path)
+        if mask is not None:
+            return mask
+
+    shapely.prepare(country_polygon)
+    mask = shapely.contains_xy(country_polygon, lon, lat)
+    if cache_dir is not None:
+        _save_cached(path, mask)
+    return mask
+
+
+def point_bounds(lon, lat, mask):
+    """Equivalent of ``total_bounds`` for the masked points."""
+    return lon[mask].min(), lat[mask].min(), lon[mask].max(), lat[mask].max()
+
+
+def _grid_axes(bounds, cell_size_deg):
+    minx, miny, maxx, maxy = bounds
+    return np.arange(minx, maxx, cell_size_deg), np.arange(miny, maxy, cell_size_deg)
+
+
+def build_grid(bounds, cell_size_deg, country_polygon):
+    """Build the grid cells over ``bounds`` and clip them to the country.
+
+    ``grid_id`` follows the x-major numbering of the original nested loops.
+    """
+    xs, ys = _grid_axes(bounds, cell_size_deg)
+    x0, y0 = np.meshgrid(xs, ys, indexing="ij")
+    x0, y0 = x0.ravel(), y0.ravel()
+    cells = shapely.box(x0, y0, x0 + cell_size_deg, y0 + cell_size_deg)
+
+    grid = gpd.GeoDataFrame({"grid_id": np.arange(len(cells))}, geometry=cells, crs="EPSG:4326")
+
+    # Clip grid cells to the country boundary
+    return gpd.clip(grid, country_polygon)
+
+
+def assign_cells(lon, lat, mask, grid, bounds, cell_size_deg):
+    """Row position in ``grid`` of every point, or -1 if it is not gridded."""
+    minx, miny = bounds[0], bounds[1]
+    xs, ys = _grid_axes(bounds, cell_size_deg)
+
+    ix = np.floor((lon - minx) / cell_size_deg).astype(np.int64)
+    iy = np.floor((lat - miny) / cell_size_deg).astype(np.int64)
+    inside = mask & (ix >= 0) & (ix < len(xs)) & (iy >= 0) & (iy < len(ys))
+
+    # Map grid_id -> row of the clipped grid (cells dropped by the clip stay -1)
+    lookup = np.full(len(xs) * len(ys), -1, dtype=np.int64)
+    lookup[grid["grid_id"].to_numpy()] = np.arange(len(grid))
+
+    cells = np.full(lon.shape, -1, dtype=np.int64)
+    cells[inside] = lookup[ix[inside] * len(ys) + iy[inside]]
+    return cells
+
+
+def period_codes(slices):
+    """Unique (year, month) periods and the period index of every slice."""
+    codes = slices.groupby(["year", "month"], sort=True).ngroup().to_numpy()
+    periods = (
+        slices[["year", "month"]]
+        .drop_duplicates()
+        .sort_values(["year", "month"])
+        .reset_index(drop=True)
+    )
+    return periods, codes
+
+
+def aggregate_periods(values, cells, n_cells, codes):
+    """(period x cell) means of the non-null values, NaN where a cell has none.
+
+    Slices sharing a period code are pooled, which matches grouping the
+    long table by (year, month) and averaging per grid cell.
+    """
+    values = np.asarray(values, dtype=float).reshape(-1, cells.size)
+    codes = np.asarray(codes, dtype=np.int64)
+    n_periods = int(codes.max()) + 1
+
+    keep = cells >= 0
+    size = n_periods * n_cells
+    sums, counts = np.zeros(size), np.zeros(size)
+    _accumulate(sums, counts, values[:, keep], codes, cells[keep], n_cells)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_periods, n_cells)
+
+
+def _accumulate(sums, counts, values, codes, cells, n_cells):
+    # Add a (slices x points) block into the flat (period, cell) sums and counts
+    keys = codes[:, None] * n_cells + cells[None, :]
+    valid = ~np.isnan(values)
+    sums += np.bincount(keys[valid], weights=values[valid], minlength=sums.size)
+    counts += np.bincount(keys[valid], minlength=counts.size)
+
+
+def stream_aggregate_periods(da, x_name, y_name, cells, n_cells, codes=None, transform=None, rows_per_block=None):
+    """Streaming variant of ``aggregate_periods`` for lazily opened data.
+
+    Reads one slice (and, with ``rows_per_block``, one band of rows) at a
+    time, so peak memory is bounded by the block size rather than the file
+    size. Blocks without any gridded point are never read. ``transform`` is
+    applied to every block, e.g. for unit conversions. Without ``codes`` all
+    slices are pooled into a single period; slices with a negative code are
+    skipped.
+    """
+    other_dims = [d for d in da.dims if d not in (x_name, y_name)]
+    da = da.transpose(*other_dims, y_name, x_name)
+    other_shape = tuple(da.sizes[d] for d in other_dims)
+    ny, nx = da.sizes[y_name], da.sizes[x_name]
+    rows_per_block = rows_per_block or ny
+
+    n_slices = int(np.prod(other_shape))
+    codes = np.zeros(n_slices, dtype=np.int64) if codes is None else np.asarray(codes, dtype=np.int64)
+    n_periods = int(codes.max()) + 1
+    size = n_periods * n_cells
+    sums, counts = np.zeros(size), np.zeros(size)
+    cells = cells.reshape(ny, nx)
+
+    for i in range(n_slices):
+        if codes[i] < 0:
+            continue
+        index = dict(zip(other_dims, np.unravel_index(i, other_shape)))
+        for row in range(0, ny, rows_per_block):
+            block_cells = cells[row:row + rows_per_block].ravel()
+            keep = block_cells >= 0
+            if not keep.any():
+                continue
+            block = da.isel(index).isel({y_name: slice(row, row + rows_per_block)}).values
+            block = np.asarray(block, dtype=float).reshape(1, -1)[:, keep]
+            if transform is not None:
+                block = transform(block)
+            _accumulate(sums, counts, block, codes[i:i + 1], block_cells[keep], n_cells)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_periods, n_cells)
+
+
+def aggregate_mean(values, cells, n_cells):
+    """Mean of the non-null values falling in each cell (NaN if none)."""
+    values = np.asarray(values, dtype=float).reshape(-1, cells.size)
+    return aggregate_periods(values, cells, n_cells, np.zeros(len(values), dtype=np.int64))[0]
+
+
+def cell_centroids(grid):
+    """(n_cells x 2) array of grid cell centroids."""
+    centroids = grid.geometry.centroid
+    return np.column_stack([centroids.x.to_numpy(), centroids.y.to_numpy()])
+
+
+def _build_fill_index(centroids, missing):
+    index = np.arange(len(missing))
+    if missing.any() and not missing.all():
+        known = np.flatnonzero(~missing)
+        # Build a KDTree from the known points and query for the nearest neighbor of each unknown cell.
+        tree = scipy.spatial.cKDTree(centroids[known])
+        distances, indices = tree.query(centroids[missing], k=1)
+        index[missing] = known[indices]
+    return index
+
+
+def nearest_fill_index(centroids, missing, cache_dir=None):
+    """Index of the cell each cell takes its value from.
+
+    Known cells point to themselves and missing cells to their nearest known
+    neighbour, so filling is a plain ``values[..., index]``. With
+    ``cache_dir`` the index is stored as ``fill_<hash>.npy``, keyed on the
+    grid centroids and the missing-data mask, and reused by later runs with
+    the same coverage without building a tree.
+    """
+    if cache_dir is None:
+        return _build_fill_index(centroids, missing)
+
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(centroids, dtype=float).tobytes())
+    key.update(np.packbits(missing).tobytes())
+    path = os.path.join(cache_dir, f"fill_{key.hexdigest()[:16]}.npy")
+    index = _load_cached(path)
+    if index is not None:
+        return index
+
+    index = _build_fill_index(centroids, missing)
+    _save_cached(path, index)
+    return index
+
+
+def fill_nearest_periods(centroids, mean_vals, cache_dir=None):
+    """Nearest-neighbour fill of a (period x cell) array.
+
+    The fill index is looked up once per distinct missing-data mask, so
+    periods with the same coverage share a single plan.
+    """
+    mean_vals = np.array(mean_vals, dtype=float, ndmin=2)
+    masks, inverse = np.unique(np.isnan(mean_vals), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for i, missing in enumerate(masks):
+        rows = np.flatnonzero(inverse == i)
+        mean_vals[rows] = mean_vals[rows][:, nearest_fill_index(centroids, missing, cache_dir)]
+
+    # Only periods without any data stay null after this; the overall-mean
+    # fallback of the original scripts is NaN for them as well.
+    return mean_vals
+
+
+def fill_nearest(grid, mean_val, cache_dir=None):
+    """Fill missing cells with the value of the nearest known cell centroid."""
+    return fill_nearest_periods(cell_centroids(grid), mean_val, cache_dir)[0]
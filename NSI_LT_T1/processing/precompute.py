@@ -1,74 +1,34 @@
 # precompute.py
-import geopandas as gpd
-import pandas as pd
-import numpy as np
 import xarray as xr
-from shapely.geometry import Point, Polygon
 
-# 1. Read shapefile (EPSG:4326) or reproject as needed
-nuts = gpd.read_file("NUTS_RG_01M_2021_3035.shp.zip").to_crs(epsg=4326)
+import gridding
+import grid_store
 
+# 1. Read shapefile (EPSG:4326) or reproject as needed
 country_code = "PL"
-country_gdf = nuts[nuts["CNTR_CODE"] == country_code]
-country_polygon = country_gdf.union_all()
-
-# 2. Load NetCDF
-ds = xr.open_dataset("avg_temp_pl_jan_feb.nc")  # or "raw_lt_temp.nc"
-df_temp = ds.to_dataframe().reset_index()
-
-df_temp.rename(
-    columns={"x": "longitude", "y": "latitude", "LST": "value"},
-    inplace=True
-)
-df_temp["longitude"] = df_temp["longitude"].astype(float)
-df_temp["latitude"]  = df_temp["latitude"].astype(float)
-df_temp["value"]     = df_temp["value"].astype(float)
+country_polygon = gridding.load_country_polygon("NUTS_RG_01M_2021_3035.shp.zip", country_code)
 
-# Kelvin -> Celsius
-df_temp["value"] = df_temp["value"] - 273.15
+# Raster rows read per block while aggregating (None reads whole slices)
+rows_per_block = None
 
-# Make point GDF
-from shapely.geometry import Point
-gdf_points = gpd.GeoDataFrame(
-    df_temp,
-    geometry=[Point(lon, lat) for lon, lat in zip(df_temp["longitude"], df_temp["latitude"])],
-    crs="EPSG:4326"
-)
+# 2. Open NetCDF lazily (values are read block by block)
+ds = xr.open_dataset("avg_temp_pl_jan_feb.nc", cache=False)  # or "raw_lt_temp.nc"
+lon, lat, slices = gridding.stack_coords(ds["LST"], "x", "y")
 
 # Filter to country boundary
-gdf_points_filtered = gdf_points[gdf_points.within(country_polygon)]
+mask = gridding.country_mask(lon, lat, country_polygon)
 
 # Build the grid
-minx, miny, maxx, maxy = gdf_points_filtered.total_bounds
+bounds = gridding.point_bounds(lon, lat, mask)
 cell_size_deg = 0.1
-xs = np.arange(minx, maxx, cell_size_deg)
-ys = np.arange(miny, maxy, cell_size_deg)
-
-grid_polygons = []
-for x in xs:
-    for y in ys:
-        poly = Polygon([
-            (x,               y),
-            (x+cell_size_deg, y),
-            (x+cell_size_deg, y+cell_size_deg),
-            (x,               y+cell_size_deg)
-        ])
-        grid_polygons.append(poly)
-
-grid = gpd.GeoDataFrame(geometry=grid_polygons, crs="EPSG:4326")
-grid.reset_index(inplace=True)
-grid.rename(columns={"index": "grid_id"}, inplace=True)
-
-# Clip squares to country
-grid = gpd.clip(grid, country_polygon)
-
-# Spatial join & aggregate
-joined = gpd.sjoin(gdf_points_filtered, grid, how="left", predicate="within")
-aggregated = joined.groupby("grid_id")["value"].mean()
+grid = gridding.build_grid(bounds, cell_size_deg, country_polygon)
 
-grid["mean_val"] = grid["grid_id"].map(aggregated)
+# Bin points into the grid & aggregate (Kelvin -> Celsius)
+cells = gridding.assign_cells(lon, lat, mask, grid, bounds, cell_size_deg)
+grid["mean_val"] = gridding.stream_aggregate_periods(
+    ds["LST"], "x", "y", cells, len(grid), transform=lambda v: v - 273.15, rows_per_block=rows_per_block
+)[0]
 
-# Now save the final polygons with a mean_val column
-# You can write to GeoJSON, shapefile, or GeoPackage, etc.
-grid.to_file("grid_aggregated_PL.geojson", driver="GeoJSON")
-print("Saved aggregated grid to grid_aggregated.geojson.")
+# Now save the polygons once with a compact mean_val column
+grid_store.write_store("../store", "lst_mean", country_code, grid, grid["mean_val"])
+print(f"Saved aggregated grid to ../store/lst_mean/{country_code}.")
@@ -0,0 +1,304 @@
+# precompute_all.py
+"""Run the precompute scripts as one job matrix (layer x country x year).
+
+The per-script settings (input file, variable, coordinate names, cell size,
+unit conversion, fill) live in ``LAYERS``; jobs run on a process pool. The
+NUTS file is read once and the country outlines are handed to the workers,
+and country masks are cached per input raster grid. A layer is skipped
+when the content hashes of its input, the NUTS file, its settings and the
+processing code match the ``build.json`` stamp written next to its store.
+
+    python precompute_all.py                      # every layer, LT and PL
+    python precompute_all.py -l tasmi -c PL       # one layer, one country
+    python precompute_all.py -y 2024 --force      # recompute 2024 only
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import shapely
+import xarray as xr
+
+import gridding
+import grid_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NUTS_PATH = "../nuts/NUTS_RG_01M_2021_3035.shp.zip"
+STORE_ROOT = "../store"
+CACHE_DIR = "fill_cache"
+COUNTRY_CODES = ["LT", "PL"]
+
+# Store variable -> settings of the script that produces it. ``inputs`` maps
+# country codes to NetCDF files (relative to this directory); values are
+# converted as ``value * scale + offset``.
+LAYERS = {
+    "air_temperature": {  # compute_temperature.py
+        "inputs": {
+            "LT": "../raw/monthly_lt_avg_air_temperatures_2023_2024.nc",
+            "PL": "../raw/monthly_pl_avg_air_temperatures_2023_2024.nc",
+        },
+        "data_var": "t2m", "x": "longitude", "y": "latitude", "time": None,
+        "cell_size_deg": 0.1, "bounds": "country", "fill": True, "offset": -273.15,
+    },
+    "soil_moisture": {  # moisture.py
+        "inputs": {
+            "LT": "../raw/Lithuania_SoilMoisture_2023_2024.nc",
+            "PL": "../raw/Poland_SoilMoisture_2023_2024.nc",
+        },
+        "data_var": "sm", "x": "lon", "y": "lat", "time": "time",
+        "cell_size_deg": 0.1, "bounds": "country", "fill": True, "scale": 100.0,
+    },
+    "lst": {  # year_precompute.py
+        "inputs": {"PL": "avg_temp_pl_2023_2024.nc"},
+        "data_var": "LST", "x": "x", "y": "y", "time": "t",
+        "cell_size_deg": 0.1, "bounds": "points", "fill": False, "offset": -273.15,
+    },
+    "soil_moisture_vwc": {  # moisture_compute.py
+        "inputs": {"LT": "soil_moisture_vwc_lithuania_time_series_2023_2024_s2_adjusted.nc"},
+        "data_var": "VWC_percent", "x": "x", "y": "y", "time": "t",
+        "cell_size_deg": 0.1, "bounds": "points", "fill": False,
+    },
+    "lst_mean": {  # precompute.py
+        "inputs": {"PL": "avg_temp_pl_jan_feb.nc"},
+        "data_var": "LST", "x": "x", "y": "y", "time": None, "periods": False,
+        "cell_size_deg": 0.1, "bounds": "points", "fill": False, "offset": -273.15,
+    },
+    "tasmi": {  # tasmi.py, thermal_anomaly.py
+        "inputs": {
+            "LT": "../raw/cleaned_TASMI_LT.nc",
+            "PL": "../raw/cleaned_TASMI_PL.nc",
+        },
+        "data_var": "tasmi", "x": "x", "y": "y", "time": None, "periods": False,
+        "cell_size_deg": 0.05, "bounds": "country", "fill": True, "column": "mean_tasmi",
+    },
+    "drought_stress": {  # drought_stress_grid.py
+        "inputs": {
+            "LT": "../raw/Drought Stress Index (DSI)_LT.nc",
+            "PL": "../raw/Drought Stress Index (DSI)_PL.nc",
+        },
+        "data_var": "__xarray_dataarray_variable__", "x": "x", "y": "y", "time": None, "periods": False,
+        "cell_size_deg": 0.05, "bounds": "country", "fill": True,
+    },
+}
+
+# Code whose changes invalidate every stored layer
+CODE_FILES = ["gridding.py", "grid_store.py", "precompute_all.py"]
+
+
+def _path(path):
+    return os.path.join(HERE, path)
+
+
+def file_digest(path, known=None):
+    """SHA-1 of a file's content.
+
+    ``known`` is a previous ``{"size", "mtime_ns", "sha1"}`` record of the
+    same file; its digest is reused while size and mtime are unchanged, so
+    unchanged inputs are not re-read.
+    """
+    stat = os.stat(path)
+    if known and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+        return known
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest.hexdigest()}
+
+
+def build_path(variable, country_code):
+    return os.path.join(grid_store.store_dir(_path(STORE_ROOT), variable, country_code), "build.json")
+
+
+def read_build(variable, country_code):
+    path = build_path(variable, country_code)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def layer_digest(variable, country_code, files):
+    """Combined digest of a layer's settings and the file records in ``files``."""
+    digest = hashlib.sha1(json.dumps(LAYERS[variable], sort_keys=True).encode())
+    digest.update(country_code.encode())
+    for name in sorted(files):
+        digest.update(files[name]["sha1"].encode())
+    return digest.hexdigest()
+
+
+def _transform(spec):
+    scale, offset = spec.get("scale", 1.0), spec.get("offset", 0.0)
+    if scale == 1.0 and offset == 0.0:
+        return None
+    return lambda v: v * scale + offset
+
+
+# Country outlines of the current pool, set once per worker process
+_polygons = {}
+
+
+def _init_worker(polygons_wkb):
+    _polygons.update({cc: shapely.from_wkb(wkb) for cc, wkb in polygons_wkb.items()})
+
+
+def run_job(variable, country_code, years=None, rows_per_block=None):
+    """Aggregate one layer for one country, restricted to ``years`` if given.
+
+    Returns ``(grid, periods, mean_vals)``; ``periods`` is None for layers
+    without a time axis.
+    """
+    spec = LAYERS[variable]
+    polygon = _polygons[country_code]
+    cache_dir = _path(CACHE_DIR)
+
+    ds = xr.open_dataset(_path(spec["inputs"][country_code]), cache=False)
+    da = ds[spec["data_var"]]
+    lon, lat, slices = gridding.stack_coords(da, spec["x"], spec["y"], spec["time"])
+
+    mask = gridding.country_mask(lon, lat, polygon, cache_dir=cache_dir)
+    bounds = polygon.bounds if spec["bounds"] == "country" else gridding.point_bounds(lon, lat, mask)
+    grid = gridding.build_grid(bounds, spec["cell_size_deg"], polygon)
+    cells = gridding.assign_cells(lon, lat, mask, grid, bounds, spec["cell_size_deg"])
+
+    periods, codes = None, None
+    if spec.get("periods", True):
+        selected = slices["year"].isin(years).to_numpy() if years else np.ones(len(slices), dtype=bool)
+        periods, selected_codes = gridding.period_codes(slices[selected])
+        codes = np.full(len(slices), -1, dtype=np.int64)
+        codes[selected] = selected_codes
+
+    mean_vals = gridding.stream_aggregate_periods(
+        da, spec["x"], spec["y"], cells, len(grid), codes,
+        transform=_transform(spec), rows_per_block=rows_per_block,
+    )
+    ds.close()
+    if spec["fill"]:
+        mean_vals = gridding.fill_nearest_periods(gridding.cell_centroids(grid), mean_vals, cache_dir=cache_dir)
+    return grid, periods, mean_vals
+
+
+def input_years(variable, country_code):
+    """Years on the time axis of a layer's input (None without a time axis)."""
+    spec = LAYERS[variable]
+    if not spec.get("periods", True):
+        return None
+    with xr.open_dataset(_path(spec["inputs"][country_code]), cache=False) as ds:
+        slices = gridding.stack_coords(ds[spec["data_var"]], spec["x"], spec["y"], spec["time"])[2]
+    return sorted(int(y) for y in slices["year"].unique())
+
+
+def _merge_stored(variable, country_code, periods, mean_vals):
+    # Keep the stored periods of the years that were not recomputed
+    column = LAYERS[variable].get("column", "mean_val")
+    if not grid_store.has_store(_path(STORE_ROOT), variable, country_code):
+        return periods, mean_vals
+    stored_periods, stored_vals = grid_store.read_cube(_path(STORE_ROOT), variable, country_code, column)
+    if stored_vals.shape[1] != mean_vals.shape[1]:
+        return periods, mean_vals
+    keep = ~stored_periods["year"].isin(periods["year"]).to_numpy()
+    periods = pd.concat([stored_periods[keep], periods], ignore_index=True)
+    mean_vals = np.vstack([stored_vals[keep], mean_vals])
+    order = np.lexsort((periods["month"].to_numpy(), periods["year"].to_numpy()))
+    return periods.iloc[order].reset_index(drop=True), mean_vals[order]
+
+
+def plan(variables, country_codes, years=None, force=False):
+    """Layers to rebuild as ``{(variable, country): (digest, files, job years)}``."""
+    code = {name: file_digest(_path(name)) for name in CODE_FILES}
+    nuts = file_digest(_path(NUTS_PATH))
+    todo = {}
+    for variable in variables:
+        for country_code in country_codes:
+            input_path = LAYERS[variable]["inputs"].get(country_code)
+            if input_path is None:
+                continue
+            if not os.path.exists(_path(input_path)):
+                print(f"Skipping {variable}/{country_code}: {input_path} not found.")
+                continue
+
+            build = read_build(variable, country_code)
+            known = build.get("files", {})
+            files = dict(code, nuts=nuts, input=file_digest(_path(input_path), known.get("input")))
+            digest = layer_digest(variable, country_code, files)
+            up_to_date = (build.get("digest") == digest
+                          and grid_store.has_store(_path(STORE_ROOT), variable, country_code))
+            if up_to_date and not force:
+                continue
+
+            job_years = input_years(variable, country_code)
+            if job_years is not None and years:
+                job_years = [y for y in job_years if y in years]
+                if not job_years:
+                    continue
+            todo[(variable, country_code)] = (digest, files, job_years)
+    return todo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-l", "--layers", nargs="+", choices=sorted(LAYERS), default=sorted(LAYERS))
+    parser.add_argument("-c", "--countries", nargs="+", default=COUNTRY_CODES)
+    parser.add_argument("-y", "--years", nargs="+", type=int,
+                        help="only recompute these years (stored periods of other years are kept)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--rows-per-block", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the inputs are unchanged")
+    args = parser.parse_args()
+
+    start = time.time()
+    countries = [cc.upper() for cc in args.countries]
+    todo = plan(args.layers, countries, args.years, args.force)
+    if not todo:
+        print("All layers are up to date.")
+        return
+
+    # One job per (layer, country, year); layers without a time axis are a single job
+    jobs = []
+    for (variable, country_code), (_, _, job_years) in todo.items():
+        for year in (job_years if job_years is not None else [None]):
+            jobs.append((variable, country_code, [year] if year is not None else None))
+
+    polygons = gridding.load_country_polygons(_path(NUTS_PATH), sorted({cc for _, cc in todo}))
+    polygons_wkb = {cc: shapely.to_wkb(polygon) for cc, polygon in polygons.items()}
+
+    results = {key: [] for key in todo}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(polygons_wkb,)) as pool:
+        futures = {pool.submit(run_job, variable, cc, years, args.rows_per_block): (variable, cc)
+                   for variable, cc, years in jobs}
+        for future in as_completed(futures):
+            results[futures[future]].append(future.result())
+
+    for (variable, country_code), parts in sorted(results.items()):
+        digest, files, job_years = todo[(variable, country_code)]
+        spec = LAYERS[variable]
+        grid = parts[0][0]
+        periods, mean_vals = None, parts[0][2]
+        if spec.get("periods", True):
+            periods = pd.concat([p for _, p, _ in parts], ignore_index=True)
+            mean_vals = np.vstack([v for _, _, v in parts])
+            order = np.lexsort((periods["month"].to_numpy(), periods["year"].to_numpy()))
+            periods, mean_vals = periods.iloc[order].reset_index(drop=True), mean_vals[order]
+            if args.years:
+                periods, mean_vals = _merge_stored(variable, country_code, periods, mean_vals)
+
+        grid_store.write_store(_path(STORE_ROOT), variable, country_code, grid, mean_vals, periods,
+                               column=spec.get("column", "mean_val"))
+        # Only a full build marks the layer up to date; a partial (--years) one leaves the stamp alone
+        if not args.years:
+            with open(build_path(variable, country_code), "w") as f:
+                json.dump({"digest": digest, "files": files}, f, indent=1)
+        n_periods = len(periods) if periods is not None else 1
+        print(f"Saved {n_periods} period(s) of {variable} for {country_code}.")
+
+    print(f"Precomputed {len(todo)} layer(s) in {len(jobs)} job(s), {time.time() - start:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import os
 import folium
-import geopandas as gpd
 from flask import Blueprint, request
 from folium.elements import Element
 from .navigation import get_nav_bar_html  # Import the navigation component
+from .grid_data import (cached_map_html, crop_availability, grid_geojson, grid_key, load_grid,
+                        load_suitable_cells, map_center)
 
 
 agriculture_bp = Blueprint("agriculture_bp", __name__, url_prefix="/agriculture")
@@ -55,19 +56,25 @@ def agriculture():
         "Peas": "20 – 25"
     }
 
+    # Crop/month options come from the suitability index written by crops_by_temperatur.py;
+    # older outputs without one are found by probing the per-crop GeoJSON files.
+    availability = crop_availability(country_code)
     available_crops = {}
     for cp, cond in crop_conditions.items():
-        planting_value = cond['planting_month']
-        if "-" in planting_value:
-            start, end = planting_value.split("-")
-            months_list = [f"{m:02d}" for m in range(int(start), int(end) + 1)]
+        if availability is not None:
+            avail_months = availability.get(cp, {}).get(year, [])
         else:
-            months_list = [planting_value]
-        avail_months = []
-        for m in months_list:
-            filename = f"crop_geojsons/grid_{cp.replace(' ', '_')}_{country_code}_{year}_{m}.geojson"
-            if os.path.exists(filename):
-                avail_months.append(m)
+            planting_value = cond['planting_month']
+            if "-" in planting_value:
+                start, end = planting_value.split("-")
+                months_list = [f"{m:02d}" for m in range(int(start), int(end) + 1)]
+            else:
+                months_list = [planting_value]
+            avail_months = []
+            for m in months_list:
+                filename = f"crop_geojsons/grid_{cp.replace(' ', '_')}_{country_code}_{year}_{m}.geojson"
+                if os.path.exists(filename):
+                    avail_months.append(m)
         if avail_months:
             available_crops[cp] = avail_months
 
@@ -94,51 +101,54 @@ def agriculture():
             for m in avail_months
         ])
         filename = f"crop_geojsons/grid_{crop.replace(' ', '_')}_{country_code}_{year}_{month}.geojson"
-        if not os.path.exists(filename):
+        if availability is not None:
+            key = grid_key("crop_suitability", country_code, filename, year, month, column=crop)
+            grid = load_suitable_cells(crop, country_code, year, month)
+        else:
+            key = grid_key(None, country_code, filename, year, month)
+            grid = load_grid(*key)
+        if grid is None:
             message = f"<p style='text-align:center;color:red;'>File {filename} not found.</p>"
         else:
-            grid = gpd.read_file(filename)
-            if not grid.empty:
-                centroid = grid.unary_union.centroid
-                map_center = [centroid.y, centroid.x]
-            else:
-                map_center = [0, 0]
-            m = folium.Map(location=map_center, zoom_start=7)
-            grid_json = grid.to_json()
+            def render_map():
+                m = folium.Map(location=map_center(key, grid), zoom_start=7)
+                grid_json = grid_geojson(key, grid)
+
+                def style_function(feature):
+                    return {
+                        'fillColor': '#228B22',
+                        'color': 'white',
+                        'weight': 1,
+                        'fillOpacity': 0.5
+                    }
+                folium.GeoJson(
+                    data=grid_json,
+                    style_function=style_function,
+                    tooltip=folium.GeoJsonTooltip(
+                        fields=['grid_id', 'mean_temp', 'mean_moisture'],
+                        aliases=['Grid ID:', 'Mean Temp:', 'Mean Moisture:'],
+                        localize=True
+                    )
+                ).add_to(m)
 
-            def style_function(feature):
-                return {
-                    'fillColor': '#228B22',
-                    'color': 'white',
-                    'weight': 1,
-                    'fillOpacity': 0.5
-                }
-            folium.GeoJson(
-                data=grid_json,
-                style_function=style_function,
-                tooltip=folium.GeoJsonTooltip(
-                    fields=['grid_id', 'mean_temp', 'mean_moisture'],
-                    aliases=['Grid ID:', 'Mean Temp:', 'Mean Moisture:'],
-                    localize=True
-                )
-            ).add_to(m)
+                legend_html = f"""
+                 <div style="position: fixed;
+                             bottom: 50px; left: 50px;
+                             border:2px solid grey; z-index:9999; font-size:14px;
+                             background-color:white;
+                             padding: 10px;
+                             max-width: 200px;
+                             max-height: 100px;
+                             overflow: auto;">
+                   <strong>Crop:</strong> {crop}<br>
+                   <strong>Year:</strong> {year}<br>
+                   <strong>Month:</strong> {month}
+                 </div>
+                """
+                m.get_root().html.add_child(Element(legend_html))
+                return m._repr_html_()
 
-            legend_html = f"""
-             <div style="position: fixed;
-                         bottom: 50px; left: 50px;
-                         border:2px solid grey; z-index:9999; font-size:14px;
-                         background-color:white;
-                         padding: 10px;
-                         max-width: 200px;
-                         max-height: 100px;
-                         overflow: auto;">
-               <strong>Crop:</strong> {crop}<br>
-               <strong>Year:</strong> {year}<br>
-               <strong>Month:</strong> {month}
-             </div>
-            """
-            m.get_root().html.add_child(Element(legend_html))
-            map_html = m._repr_html_()
+            map_html = cached_map_html("agriculture", key, render_map)
     elif crop:
         message = "<p style='text-align:center;color:red;'>Selected crop not available for the chosen country and year.</p>"
 
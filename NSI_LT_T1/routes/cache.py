@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and approximate memory use.
+
+    Every entry remembers the mtimes of the files it was built from and is
+    rebuilt as soon as one of them changes, appears or disappears.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, sources, build):
+        signature = _signature(sources)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = build()
+        size = _sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            if size <= self.max_bytes:
+                self._entries[key] = (signature, value, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    self._bytes -= self._entries.popitem(last=False)[1][2]
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def _signature(sources):
+    signature = []
+    for path in sources:
+        try:
+            signature.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            signature.append((path, None))
+    return tuple(signature)
+
+
+def _sizeof(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, "memory_usage"):
+        size = int(value.memory_usage(deep=True).sum())
+        # memory_usage only counts the pointers of geometry columns; add 16 bytes per (x, y)
+        columns = value.items() if hasattr(value, "columns") else [(None, value)]
+        for _, column in columns:
+            if getattr(column.dtype, "name", None) == "geometry":
+                size += int(shapely.get_num_coordinates(np.asarray(column.values)).sum()) * 16
+        return size
+    return sys.getsizeof(value)
+
+
+# Shared by all blueprints: parsed grids, map centres, GeoJSON and rendered map HTML
+map_cache = LRUCache(
+    max_entries=int(os.environ.get("MAP_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("MAP_CACHE_MAX_MB", 512)) * 1024 * 1024,
+)
@@ -0,0 +1,139 @@
+import os
+import geopandas as gpd
+import numpy as np
+from processing import crop_suitability, grid_store
+from .cache import map_cache
+
+# Columnar grid store written by the processing scripts (see processing/grid_store.py)
+STORE_ROOT = "store"
+
+
+def grid_key(variable, country_code, legacy_filename, year=None, month=None, column="mean_val"):
+    """Cache key identifying one period of one layer; pass it as ``load_grid(*key)``."""
+    return (variable, country_code, legacy_filename, year, month, column)
+
+
+def _metadata_path(key):
+    variable, country_code, legacy_filename = key[:3]
+    if variable is not None and grid_store.has_store(STORE_ROOT, variable, country_code):
+        return grid_store.metadata_path(STORE_ROOT, variable, country_code)
+    return f"{legacy_filename}.meta.json"
+
+
+def _sources(key):
+    variable, country_code, legacy_filename = key[:3]
+    sources = [legacy_filename, f"{legacy_filename}.meta.json"]
+    if variable is not None:
+        directory = grid_store.store_dir(STORE_ROOT, variable, country_code)
+        sources += [os.path.join(directory, name) for name in ("grid.parquet", "values.parquet", "meta.json")]
+    return sources
+
+
+def _read_grid(variable, country_code, legacy_filename, year, month, column):
+    grid = None
+    if variable is not None:
+        try:
+            grid = grid_store.read_period(STORE_ROOT, variable, country_code, year, month, column)
+        except ValueError:
+            grid = None
+    if grid is None and os.path.exists(legacy_filename):
+        grid = gpd.read_file(legacy_filename)
+    return grid
+
+
+def load_grid(variable, country_code, legacy_filename, year=None, month=None, column="mean_val"):
+    """Load one period's grid from the store, falling back to the legacy GeoJSON file.
+
+    Returns None when neither source has the requested period. The result is
+    shared between requests and must not be modified.
+    """
+    key = grid_key(variable, country_code, legacy_filename, year, month, column)
+    return map_cache.get_or_build(("grid",) + key, _sources(key), lambda: _read_grid(*key))
+
+
+def in_store(key):
+    """Whether the period identified by ``key`` is in the grid store (and can be tiled)."""
+    variable, country_code = key[:2]
+    if variable is None or not grid_store.has_store(STORE_ROOT, variable, country_code):
+        return False
+    metadata = grid_metadata(key)
+    try:
+        return metadata is not None and grid_store.period_label(key[3], key[4]) in metadata["periods"]
+    except ValueError:
+        return False
+
+
+def grid_metadata(key):
+    """Metadata sidecar written by the processing stage, or None for older outputs."""
+    return map_cache.get_or_build(
+        ("meta",) + key, _sources(key), lambda: grid_store.read_metadata(_metadata_path(key))
+    )
+
+
+def map_center(key, grid):
+    """[lat, lon] to centre the map on; read from the sidecar when there is one."""
+    metadata = grid_metadata(key)
+    if metadata is not None:
+        return metadata["centroid"]
+
+    def build():
+        if grid.empty:
+            return [0, 0]
+        centroid = grid.unary_union.centroid
+        return [centroid.y, centroid.x]
+    return map_cache.get_or_build(("center",) + key, _sources(key), build)
+
+
+def legend_bins(key, n_bins=6):
+    """Choropleth bin edges from the sidecar value range.
+
+    Matches folium's default equal-width binning; falls back to ``n_bins``
+    (folium computes the edges itself) when no statistics are available.
+    """
+    metadata = grid_metadata(key)
+    if metadata is None:
+        return n_bins
+    try:
+        stats = metadata["periods"].get(grid_store.period_label(key[3], key[4]))
+    except ValueError:
+        return n_bins
+    if stats is None:
+        return n_bins
+    return list(np.linspace(stats["min"], stats["max"], n_bins + 1))
+
+
+def grid_geojson(key, grid):
+    """Serialized GeoJSON of the grid."""
+    return map_cache.get_or_build(("geojson",) + key, _sources(key), grid.to_json)
+
+
+def cached_map_html(name, key, build):
+    """Rendered map HTML of page ``name`` for the grid identified by ``key``."""
+    return map_cache.get_or_build(("map", name) + key, _sources(key), build)
+
+
+def _suitability_sources(country_code):
+    directory = grid_store.store_dir(STORE_ROOT, crop_suitability.VARIABLE, country_code)
+    return [os.path.join(directory, name)
+            for name in ("grid.parquet", "values.parquet", "suitability.parquet", "availability.json")]
+
+
+def crop_availability(country_code):
+    """{crop: {year: [months]}} from the suitability index, or None if it has not been built."""
+    return map_cache.get_or_build(
+        ("availability", country_code),
+        _suitability_sources(country_code),
+        lambda: crop_suitability.read_availability(STORE_ROOT, country_code),
+    )
+
+
+def load_suitable_cells(crop, country_code, year, month):
+    """Cells suitable for ``crop`` in one period, with mean_temp and mean_moisture (None if none)."""
+    def build():
+        try:
+            return crop_suitability.read_suitable_cells(STORE_ROOT, country_code, crop, year, month)
+        except ValueError:
+            return None
+    return map_cache.get_or_build(
+        ("suitable", crop, country_code, year, month), _suitability_sources(country_code), build
+    )
@@ -1,9 +1,9 @@
-import os
 import folium
-import geopandas as gpd
 from flask import Blueprint, request
 from folium.elements import Element
 from .navigation import get_nav_bar_html  # Import the navigation component
+from .grid_data import cached_map_html, grid_geojson, grid_key, in_store, legend_bins, load_grid, map_center
+from .tiles import add_grid_tiles
 
 index_bp = Blueprint("index_bp", __name__)
 
@@ -24,48 +24,55 @@ def index():
     # Determine the base directory and header based on dataset choice.
     if dataset_choice == "air":
         base_dir = "temperature"
+        variable = "air_temperature"
         dataset_label = "Air Temperature"
         header_title = f"Air Temperature (°C) For {country_code} - {year}-{month_str}"
     else:
         base_dir = "lts"
+        variable = "lst"
         dataset_label = "LST"
         header_title = f"Land Surface Temperature (°C) For {country_code} - {year}-{month_str}"
 
-    # Construct the filename using the chosen directory.
+    # Read the period from the grid store (legacy GeoJSON in the chosen directory as fallback).
     filename = f"{base_dir}/grid_aggregated_{country_code}_{year}_{month_str}.geojson"
-    if not os.path.exists(filename):
+    key = grid_key(variable, country_code, filename, year, month_str)
+    # Stored periods are served as tiles; only legacy GeoJSON outputs are loaded and inlined
+    tiled = in_store(key)
+    grid = None if tiled else load_grid(*key)
+    if grid is None and not tiled:
         return (f"No precomputed {dataset_label} file for {country_code} for {year}-{month_str}! "
                 f"Please run precompute.py for that period.")
 
-    grid = gpd.read_file(filename)
-    map_center = [0, 0]
-    if not grid.empty:
-        centroid = grid.unary_union.centroid
-        map_center = [centroid.y, centroid.x]
+    def render_map():
+        m = folium.Map(location=map_center(key, grid), zoom_start=7)
+        if tiled:
+            add_grid_tiles(m, key, "YlOrRd", f"Mean {dataset_label} (°C)")
+        else:
+            grid_json = grid_geojson(key, grid)
+            folium.Choropleth(
+                geo_data=grid_json,
+                data=grid,
+                columns=["grid_id", "mean_val"],
+                key_on="feature.properties.grid_id",
+                fill_color="YlOrRd",
+                bins=legend_bins(key),
+                fill_opacity=0.7,
+                line_opacity=0.0,
+                legend_name=f"Mean {dataset_label} (°C)"
+            ).add_to(m)
 
-    m = folium.Map(location=map_center, zoom_start=7)
-    grid_json = grid.to_json()
-    folium.Choropleth(
-        geo_data=grid_json,
-        data=grid,
-        columns=["grid_id", "mean_val"],
-        key_on="feature.properties.grid_id",
-        fill_color="YlOrRd",
-        fill_opacity=0.7,
-        line_opacity=0.0,
-        legend_name=f"Mean {dataset_label} (°C)"
-    ).add_to(m)
+        legend_css = """
+        <style>
+          .legend {
+            font-size: 16px !important;
+            padding-top: 20px;
+          }
+        </style>
+        """
+        m.get_root().header.add_child(Element(legend_css))
+        return m._repr_html_()
 
-    legend_css = """
-    <style>
-      .legend {
-        font-size: 16px !important;
-        padding-top: 20px;
-      }
-    </style>
-    """
-    m.get_root().header.add_child(Element(legend_css))
-    map_html = m._repr_html_()
+    map_html = cached_map_html("index", key, render_map)
 
     # Build a dropdown form for dataset choice.
     form_html = f"""
@@ -1,9 +1,9 @@
-import os
 import folium
-import geopandas as gpd
 from flask import Blueprint, request
 from folium.elements import Element
 from .navigation import get_nav_bar_html  # Import the navigation component
+from .grid_data import cached_map_html, grid_geojson, grid_key, in_store, legend_bins, load_grid, map_center
+from .tiles import add_grid_tiles
 
 soil_moisture_bp = Blueprint("soil_moisture_bp", __name__, url_prefix="/soil_moisture")
 
@@ -23,38 +23,43 @@ def soil_moisture():
     # filename = f"vws/grid_aggregated_{country_code}_{year}_{month_str}.geojson"
     filename = f"moisture_new/grid_soil_moisture_{country_code}_{year}_{month_str}.geojson"
 
-    if not os.path.exists(filename):
+    key = grid_key("soil_moisture", country_code, filename, year, month_str)
+    # Stored periods are served as tiles; only legacy GeoJSON outputs are loaded and inlined
+    tiled = in_store(key)
+    grid = None if tiled else load_grid(*key)
+    if grid is None and not tiled:
         return f"No precomputed soil moisture file for {country_code} for {year}-{month_str}! Please run precompute_moisture.py for that period."
 
-    grid = gpd.read_file(filename)
-    map_center = [0, 0]
-    if not grid.empty:
-        centroid = grid.unary_union.centroid
-        map_center = [centroid.y, centroid.x]
+    def render_map():
+        m = folium.Map(location=map_center(key, grid), zoom_start=7)
+        if tiled:
+            add_grid_tiles(m, key, "Blues", "Mean Soil Moisture (% VWC)")
+        else:
+            grid_json = grid_geojson(key, grid)
+            folium.Choropleth(
+                geo_data=grid_json,
+                data=grid,
+                columns=["grid_id", "mean_val"],
+                key_on="feature.properties.grid_id",
+                fill_color="Blues",
+                bins=legend_bins(key),
+                fill_opacity=0.7,
+                line_opacity=0.0,
+                legend_name="Mean Soil Moisture (% VWC)"
+            ).add_to(m)
 
-    m = folium.Map(location=map_center, zoom_start=7)
-    grid_json = grid.to_json()
-    folium.Choropleth(
-        geo_data=grid_json,
-        data=grid,
-        columns=["grid_id", "mean_val"],
-        key_on="feature.properties.grid_id",
-        fill_color="Blues",
-        fill_opacity=0.7,
-        line_opacity=0.0,
-        legend_name="Mean Soil Moisture (% VWC)"
-    ).add_to(m)
+        legend_css = """
+        <style>
+          .legend {
+            font-size: 16px !important;
+            padding-top: 20px;
+          }
+        </style>
+        """
+        m.get_root().header.add_child(Element(legend_css))
+        return m._repr_html_()
 
-    legend_css = """
-    <style>
-      .legend {
-        font-size: 16px !important;
-        padding-top: 20px;
-      }
-    </style>
-    """
-    m.get_root().header.add_child(Element(legend_css))
-    map_html = m._repr_html_()
+    map_html = cached_map_html("soil_moisture", key, render_map)
 
     form_html = f"""
     <form method="GET" style="text-align:center; margin-bottom:20px;">
@@ -1,10 +1,10 @@
-import os
 import folium
-import geopandas as gpd
 from flask import Blueprint, request
 from folium.elements import Element
 import logging
 from .navigation import get_nav_bar_html  # Import the navigation component
+from .grid_data import cached_map_html, grid_geojson, grid_key, in_store, legend_bins, load_grid, map_center
+from .tiles import add_grid_tiles
 
 tasmi_bp = Blueprint("tasmi_bp", __name__, url_prefix="/tasmi")
 
@@ -15,40 +15,50 @@ def tasmi():
     filename = f"{base_dir}/grid_aggregated_{country_code}.geojson"
     logging.debug(f"Checking for file: {filename}")
 
-    if not os.path.exists(filename):
+    try:
+        key = grid_key("tasmi", country_code, filename, column="mean_tasmi")
+        # Stored periods are served as tiles; only legacy GeoJSON outputs are loaded and inlined
+        tiled = in_store(key)
+        grid = None if tiled else load_grid(*key)
+    except Exception as e:
+        logging.error(f"Error loading file {filename}: {e}")
+        return f"Error loading file {filename}: {e}"
+
+    if grid is None and not tiled:
         logging.error(f"File not found: {filename}")
         return f"No precomputed TASMI file. Please run precompute_tasmi.py for that period."
 
     try:
-        grid = gpd.read_file(filename)
-        map_center = [0, 0]
-        if not grid.empty:
-            centroid = grid.unary_union.centroid
-            map_center = [centroid.y, centroid.x]
+        def render_map():
+            m = folium.Map(location=map_center(key, grid), zoom_start=7)
+            if tiled:
+                add_grid_tiles(m, key, "YlOrBr", "Mean TASMI")
+            else:
+                grid_json = grid_geojson(key, grid)
+                folium.Choropleth(
+                    geo_data=grid_json,
+                    data=grid,
+                    columns=["grid_id", "mean_tasmi"],
+                    key_on="feature.properties.grid_id",
+                    fill_color="YlOrBr",  # Using a yellow-orange-brown scale for TASMI
+                    bins=legend_bins(key),
+                    fill_opacity=0.7,
+                    line_opacity=0.0,
+                    legend_name="Mean TASMI"
+                ).add_to(m)
 
-        m = folium.Map(location=map_center, zoom_start=7)
-        grid_json = grid.to_json()
-        folium.Choropleth(
-            geo_data=grid_json,
-            data=grid,
-            columns=["grid_id", "mean_tasmi"],
-            key_on="feature.properties.grid_id",
-            fill_color="YlOrBr",  # Using a yellow-orange-brown scale for TASMI
-            fill_opacity=0.7,
-            line_opacity=0.0,
-            legend_name="Mean TASMI"
-        ).add_to(m)
+            legend_css = """
+            <style>
+              .legend {
+                font-size: 16px !important;
+                padding-top: 20px;
+              }
+            </style>
+            """
+            m.get_root().header.add_child(Element(legend_css))
+            return m._repr_html_()
 
-        legend_css = """
-        <style>
-          .legend {
-            font-size: 16px !important;
-            padding-top: 20px;
-          }
-        </style>
-        """
-        m.get_root().header.add_child(Element(legend_css))
-        map_html = m._repr_html_()
+        map_html = cached_map_html("tasmi", key, render_map)
     except Exception as e:
         logging.error(f"Error loading file {filename}: {e}")
         return f"Error loading file {filename}: {e}"
@@ -0,0 +1,212 @@
+import json
+import math
+import re
+import numpy as np
+import shapely
+from branca.colormap import StepColormap
+from branca.element import MacroElement
+from branca.utilities import color_brewer
+from flask import Blueprint, Response, abort, request
+from jinja2 import Template
+from processing import grid_store
+from .cache import map_cache
+from .grid_data import STORE_ROOT, legend_bins
+
+tiles_bp = Blueprint("tiles_bp", __name__, url_prefix="/tiles")
+
+# Quantization steps per tile side (as in Mapbox Vector Tiles)
+TILE_EXTENT = 4096
+# Zoom level the pages request tiles at: ~1.4° tiles, i.e. a handful per country
+DATA_ZOOM = 8
+VALUE_COLUMNS = ("mean_val", "mean_tasmi")
+
+_name_pattern = re.compile(r"^[a-z0-9_]+$")
+_country_pattern = re.compile(r"^[A-Za-z]{2}$")
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) in degrees of a web-mercator z/x/y tile."""
+    n = 2 ** z
+
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
+
+
+def _check_layer(variable, country_code):
+    if not _name_pattern.match(variable) or not _country_pattern.match(country_code):
+        abort(404)
+    if not grid_store.has_store(STORE_ROOT, variable, country_code):
+        abort(404)
+
+
+def _store_sources(variable, country_code):
+    directory = grid_store.store_dir(STORE_ROOT, variable, country_code)
+    return [f"{directory}/grid.parquet", f"{directory}/values.parquet"]
+
+
+def _build_tile(variable, country_code, z, x, y):
+    grid = map_cache.get_or_build(
+        ("store_grid", variable, country_code),
+        _store_sources(variable, country_code),
+        lambda: grid_store.read_grid(STORE_ROOT, variable, country_code),
+    )
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    rows = np.sort(grid.sindex.query(shapely.box(minx, miny, maxx, maxy), predicate="intersects"))
+    # Each cell belongs to the one tile holding its centroid (half-open bounds), so cells
+    # crossing a tile edge are not drawn twice on the client
+    centroids = shapely.centroid(np.asarray(grid.geometry.values[rows]))
+    cx, cy = shapely.get_x(centroids), shapely.get_y(centroids)
+    owned = (cx >= minx) & (cx < maxx) & (cy > miny) & (cy <= maxy)
+    rows = rows[owned]
+
+    # Simplify away sub-pixel detail and quantize to the tile resolution
+    step = (maxx - minx) / TILE_EXTENT
+    decimals = max(0, math.ceil(-math.log10(step)))
+    geoms = shapely.simplify(np.asarray(grid.geometry.values[rows]), step)
+    geoms = shapely.transform(geoms, lambda coords: np.round(coords, decimals))
+    keep = ~shapely.is_empty(geoms)
+
+    features = ",".join(
+        '{"type":"Feature","id":%d,"geometry":%s}' % (row, geometry)
+        for row, geometry in zip(rows[keep], shapely.to_geojson(geoms[keep]))
+    )
+    return '{"type":"FeatureCollection","features":[%s]}' % features
+
+
+@tiles_bp.route("/<variable>/<country_code>/<int:z>/<int:x>/<int:y>.json", methods=["GET"])
+def grid_tile(variable, country_code, z, x, y):
+    """Simplified, quantized GeoJSON tile of a stored grid.
+
+    Features carry only their grid row as ``id``; colours come from the
+    per-period values array.
+    """
+    country_code = country_code.upper()
+    _check_layer(variable, country_code)
+    if z > 16 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+    tile = map_cache.get_or_build(
+        ("tile", variable, country_code, z, x, y),
+        _store_sources(variable, country_code),
+        lambda: _build_tile(variable, country_code, z, x, y),
+    )
+    return Response(tile, mimetype="application/json")
+
+
+@tiles_bp.route("/<variable>/<country_code>/values.json", methods=["GET"])
+def grid_values(variable, country_code):
+    """Values of one period in grid row order (null where missing)."""
+    country_code = country_code.upper()
+    _check_layer(variable, country_code)
+    year = request.args.get("year")
+    month = request.args.get("month")
+    column = request.args.get("column", "mean_val")
+    if column not in VALUE_COLUMNS:
+        abort(404)
+    # A period needs both year and month (or neither, for all periods)
+    if (year is None) != (month is None):
+        abort(404)
+    if year is not None and not (year.isdigit() and month.isdigit()):
+        abort(404)
+
+    def build():
+        values = grid_store.read_values(STORE_ROOT, variable, country_code, year, month, column)
+        return json.dumps([None if np.isnan(v) else round(float(v), 3) for v in values])
+
+    try:
+        payload = map_cache.get_or_build(
+            ("values", variable, country_code, year, month, column),
+            _store_sources(variable, country_code),
+            build,
+        )
+    except (ValueError, KeyError):
+        abort(404)
+    return Response(payload, mimetype="application/json")
+
+
+class GridTileLayer(MacroElement):
+    """Leaflet layer that loads the visible grid tiles and colours them from a values array."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var bins = {{ this.bins|tojson }};
+            var colors = {{ this.colors|tojson }};
+            var values = null;
+            var loaded = {};
+            var layer = L.geoJSON(null, {
+                style: function(feature) {
+                    var v = values[feature.id];
+                    if (v === null || v === undefined) {
+                        return {stroke: false, fillOpacity: 0};
+                    }
+                    var i = 0;
+                    while (i < colors.length - 1 && v >= bins[i + 1]) { i++; }
+                    return {stroke: false, fillColor: colors[i], fillOpacity: {{ this.fill_opacity }}};
+                }
+            }).addTo(map);
+
+            function loadVisibleTiles() {
+                var z = {{ this.zoom }}, n = Math.pow(2, z), b = map.getBounds();
+                function tx(lon) { return Math.floor((lon + 180) / 360 * n); }
+                function ty(lat) {
+                    var r = lat * Math.PI / 180;
+                    return Math.floor((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n);
+                }
+                var x0 = Math.max(tx(b.getWest()), 0), x1 = Math.min(tx(b.getEast()), n - 1);
+                var y0 = Math.max(ty(b.getNorth()), 0), y1 = Math.min(ty(b.getSouth()), n - 1);
+                for (var x = x0; x <= x1; x++) {
+                    for (var y = y0; y <= y1; y++) {
+                        var id = x + "/" + y;
+                        if (loaded[id]) { continue; }
+                        loaded[id] = true;
+                        fetch({{ this.tile_url|tojson }} + z + "/" + id + ".json")
+                            .then(function(r) { return r.json(); })
+                            .then(function(tile) { layer.addData(tile); });
+                    }
+                }
+            }
+
+            fetch({{ this.values_url|tojson }})
+                .then(function(r) { return r.json(); })
+                .then(function(v) {
+                    values = v;
+                    loadVisibleTiles();
+                    map.on("moveend", loadVisibleTiles);
+                });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, tile_url, values_url, bins, colors, fill_opacity=0.7, zoom=DATA_ZOOM):
+        super().__init__()
+        self._name = "GridTileLayer"
+        self.tile_url = tile_url
+        self.values_url = values_url
+        self.bins = [float(b) for b in bins]
+        self.colors = colors
+        self.fill_opacity = fill_opacity
+        self.zoom = zoom
+
+
+def add_grid_tiles(m, key, fill_color, legend_name, fill_opacity=0.7):
+    """Add a stored grid to folium map ``m`` as tiles plus a legend, instead of inlined GeoJSON."""
+    variable, country_code, _, year, month, column = key
+    bins = legend_bins(key)
+    if not isinstance(bins, list):
+        # No value statistics (all-null period): any range will do
+        bins = list(np.linspace(0, 1, bins + 1))
+    colors = color_brewer(fill_color, n=len(bins) - 1)
+
+    query = f"column={column}"
+    if year is not None:
+        query += f"&year={int(year)}&month={int(month)}"
+    base_url = f"{tiles_bp.url_prefix}/{variable}/{country_code}/"
+
+    GridTileLayer(base_url, f"{base_url}values.json?{query}", bins, colors, fill_opacity).add_to(m)
+    StepColormap(colors, index=bins, vmin=bins[0], vmax=bins[-1], caption=legend_name).add_to(m)
@@ -1,8 +1,15 @@
+import os
+import hashlib
+import threading
+import concurrent.futures
+from collections import deque
 import rasterio
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 from rasterio.features import rasterize
+from rasterio.windows import Window
+from shapely.geometry import box
 
 # ----- Mapping dictionary for CORINE to Ecosystem accounts -----
 # (Using only the first element = level1 classification)
@@ -54,148 +61,387 @@ clc_to_ecosystem = {
 # Create a mapping for level1 only (extract first element of each tuple)
 clc_to_level1 = {clc: mapping[0] for clc, mapping in clc_to_ecosystem.items()}
 
-def reclassify_raster_level1(input_raster, output_raster):
+# Number of threads reclassifying block windows
+reclassify_workers = os.cpu_count()
+
+
+def build_lut(mapping, level, nodata_value, size):
     """
-    Reclassifies a large raster to level1 using windowed (block) processing to avoid high memory usage.
+    Compiles clc_to_ecosystem into a dense uint16 lookup table for one level (0 = level1, 1 = level2).
+    Codes without a mapping (including the input nodata) map to nodata_value.
+    """
+    lut = np.full(size, nodata_value, dtype=np.uint16)
+    for clc_value, codes in mapping.items():
+        if clc_value < size:
+            lut[clc_value] = codes[level]
+    return lut
+
+
+def lut_size(dtype, mapping):
+    # Cover every value of small integer types so np.take never goes out of range
+    dtype = np.dtype(dtype)
+    if dtype.kind in "ui" and dtype.itemsize <= 2:
+        return 2 ** (8 * dtype.itemsize)
+    return max(mapping) + 1
+
+
+def ordered_map(executor, fn, items, max_in_flight):
+    """Like executor.map, but with at most max_in_flight pending results (results come in order)."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def reclassify_raster(input_raster, output_rasters, workers=None):
+    """
+    Reclassifies a large raster to ecosystem levels in one streaming pass.
+
+    output_rasters maps a level (0 = level1, 1 = level2) to an output path. Block windows are
+    read and reclassified with a single np.take per level on a thread pool (each thread has its
+    own dataset handle) and written in order.
     """
+    workers = workers or reclassify_workers
+    local = threading.local()
+    handles = []
+
     with rasterio.open(input_raster) as src:
         profile = src.profile.copy()
         nodata_value = src.nodata if src.nodata is not None else 0
         # Ensure nodata is within valid range (0-65535 for uint16)
         if nodata_value < 0 or nodata_value > 65535:
             nodata_value = 0
+        size = lut_size(src.dtypes[0], clc_to_ecosystem)
+        luts = {level: build_lut(clc_to_ecosystem, level, nodata_value, size) for level in output_rasters}
+        windows = [window for _, window in src.block_windows(1)]
+
+    # Update profile to use uint16, LZW compression, and proper nodata
+    profile.update(dtype=rasterio.uint16, compress='lzw', nodata=nodata_value)
+
+    def reclassify_block(window):
+        if not hasattr(local, "src"):
+            local.src = rasterio.open(input_raster)
+            handles.append(local.src)
+        # Cast before clipping: signed inputs (CLC is int8) cannot hold the table bounds
+        codes = local.src.read(1, window=window).astype(np.intp)
+        # Values outside the table (negative codes, wide or float inputs) become nodata
+        outside = (codes < 0) | (codes >= size)
+        codes = np.clip(codes, 0, size - 1)
+        blocks = {}
+        for level, lut in luts.items():
+            block = np.take(lut, codes)
+            block[outside] = nodata_value
+            blocks[level] = block
+        return window, blocks
+
+    dsts = {level: rasterio.open(path, 'w', **profile) for level, path in output_rasters.items()}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for window, blocks in ordered_map(executor, reclassify_block, windows, 4 * workers):
+                for level, block in blocks.items():
+                    dsts[level].write(block, 1, window=window)
+    finally:
+        for dst in dsts.values():
+            dst.close()
+        for src in handles:
+            src.close()
+    return output_rasters
+
 
-        # Update profile to use uint16, LZW compression, and proper nodata
-        profile.update(dtype=rasterio.uint16, compress='lzw', nodata=nodata_value)
-
-        with rasterio.open(output_raster, 'w', **profile) as dst:
-            # Process the raster by its block windows to reduce memory usage
-            for ji, window in src.block_windows(1):
-                # Read the current window from the raster
-                data = src.read(1, window=window).astype(np.int32)
-                # Create an output array for this block filled with the nodata value
-                level1_block = np.full(data.shape, fill_value=nodata_value, dtype=np.uint16)
-                # For each CLC code, assign the corresponding level1 value using the mapping dictionary
-                for clc_value, l1 in clc_to_level1.items():
-                    mask = data == clc_value
-                    level1_block[mask] = l1
-                # Write the processed block to the output raster
-                dst.write(level1_block, 1, window=window)
+def reclassify_raster_level1(input_raster, output_raster):
+    """
+    Reclassifies a large raster to level1 using windowed (block) processing to avoid high memory usage.
+    """
+    reclassify_raster(input_raster, {0: output_raster})
     return output_raster
 
+# Zone label rasters are cached here, keyed by zone file and raster grid
+label_cache_dir = "zone_labels"
+# Pixels per block of the zonal pass (about 16 MB per uint32 temporary; each worker holds a few)
+zonal_block_pixels = 1 << 22
+# Level1 codes are 1..11, so counts are kept for classes 0..11
+n_level1_classes = max(clc_to_level1.values()) + 1
+
+
+def read_zones(geojson_file, crs):
+    # Read the GeoJSON file and reproject if necessary
+    gdf = gpd.read_file(geojson_file)
+    if gdf.crs != crs:
+        gdf = gdf.to_crs(crs)
+    return gdf
+
+
+def zone_names(gdf, zone_type='NUTS0'):
+    """
+    Zone name per row: 'NUTS0' uses field "NUTS_NAME", 'NUTS2' combines "CNTR_CODE" and "NUTS_NAME".
+    """
+    names = []
+    for idx, row in gdf.iterrows():
+        if zone_type == 'NUTS0':
+            names.append(row.get('NUTS_NAME', f'zone_{idx}'))
+        elif zone_type == 'NUTS2':
+            names.append(f"{row.get('CNTR_CODE', '')}_{row.get('NUTS_NAME', '')}")
+        else:
+            names.append(f'zone_{idx}')
+    return names
+
+
+def raster_grid(src):
+    return (src.crs.to_string() if src.crs else None, tuple(src.transform)[:6], src.width, src.height)
+
+
+def block_windows(src, pixels=None):
+    """
+    Windows of about `pixels` pixels aligned to the raster's blocks: full-width row bands, split
+    into columns when a single block row of the raster is already wider than the budget.
+    """
+    pixels = pixels or zonal_block_pixels
+    block_height, block_width = src.block_shapes[0]
+    rows = max(block_height, pixels // src.width // block_height * block_height)
+    cols = src.width
+    if rows * cols > pixels:
+        cols = min(src.width, max(block_width, pixels // rows // block_width * block_width))
+    return [Window(col_off, row_off, min(cols, src.width - col_off), min(rows, src.height - row_off))
+            for row_off in range(0, src.height, rows) for col_off in range(0, src.width, cols)]
+
+
+def zone_label_raster(geojson_file, raster_file, cache_dir=None):
+    """
+    Rasterizes all zones of geojson_file onto the grid of raster_file as a uint32 label raster
+    (row number + 1, 0 outside every zone) and returns its path.
+
+    The label raster is cached in cache_dir under a hash of the zone file and the raster grid,
+    so it is built once for all years and runs.
+    """
+    cache_dir = cache_dir or label_cache_dir
+    with rasterio.open(raster_file) as src:
+        crs, transform, grid = src.crs, src.transform, raster_grid(src)
+        profile = src.profile.copy()
+        windows = block_windows(src)
+
+    digest = hashlib.sha1(repr(grid).encode())
+    with open(geojson_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    label_path = os.path.join(cache_dir, f"zones_{digest.hexdigest()}.tif")
+    if os.path.exists(label_path):
+        return label_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    gdf = read_zones(geojson_file, crs)
+    sindex = gdf.sindex
+    profile.update(driver='GTiff', dtype=rasterio.uint32, count=1, nodata=0, compress='lzw')
+    # Written under a temporary name so an interrupted run is never mistaken for a finished one
+    partial_path = label_path + ".part"
+    with rasterio.open(partial_path, 'w', **profile) as dst:
+        for window in windows:
+            labels = np.zeros((window.height, window.width), dtype=np.uint32)
+            # Only the zones whose bounding boxes touch this block are burned in
+            hits = sindex.query(box(*rasterio.windows.bounds(window, transform)))
+            if len(hits):
+                labels = rasterize(
+                    [(gdf.geometry.iloc[i], int(i) + 1) for i in hits],
+                    out_shape=labels.shape,
+                    transform=rasterio.windows.transform(window, transform),
+                    fill=0,
+                    dtype='uint32'
+                )
+            dst.write(labels, 1, window=window)
+        dst.update_tags(n_zones=len(gdf))
+    os.replace(partial_path, label_path)
+    return label_path
+
+
+def stream_blocks(paths, windows, fn, workers=None):
+    """
+    Reads the same window of every raster in paths ({key: path}) on a thread pool (one set of
+    dataset handles per thread) and yields fn({key: block}) in window order.
+    """
+    workers = workers or reclassify_workers
+    local = threading.local()
+    handles = []
+
+    def read_window(window):
+        if not hasattr(local, "srcs"):
+            local.srcs = {key: rasterio.open(path) for key, path in paths.items()}
+            handles.extend(local.srcs.values())
+        return fn({key: src.read(1, window=window) for key, src in local.srcs.items()})
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from ordered_map(executor, read_window, windows, 2 * workers)
+    finally:
+        for src in handles:
+            src.close()
+
+
+def zonal_inputs(rasters, label_rasters):
+    """
+    Nodata per class raster, zone count per label raster, block windows and the {key: path} of
+    a zonal pass; all rasters must share one grid.
+    """
+    nodata, n_zones, grids = {}, {}, set()
+    for key, path in rasters.items():
+        with rasterio.open(path) as src:
+            nodata[key] = src.nodata
+            grids.add(raster_grid(src))
+            windows = block_windows(src)
+    for key, path in label_rasters.items():
+        with rasterio.open(path) as src:
+            n_zones[key] = int(src.tags()['n_zones'])
+            grids.add(raster_grid(src))
+    if len(grids) != 1:
+        raise ValueError("Class rasters and zone label rasters must share the same grid")
+
+    paths = {('class', key): path for key, path in rasters.items()}
+    paths.update({('zone', key): path for key, path in label_rasters.items()})
+    return nodata, n_zones, windows, paths
+
+
+def zonal_histograms(rasters, label_rasters, n_classes, workers=None):
+    """
+    Pixel counts per (zone, class) of every class raster in every zone set, in one streaming pass.
+
+    rasters maps keys (e.g. years) to co-registered class rasters, label_rasters maps keys
+    (e.g. 'NUTS0') to label rasters from zone_label_raster. Each block is read once and counted
+    with np.bincount on zone * n_classes + class. Returns {(zone key, raster key): counts} with
+    counts of shape (n_zones + 1, n_classes); row 0 holds pixels outside every zone and nodata
+    pixels are not counted.
+    """
+    nodata, n_zones, windows, paths = zonal_inputs(rasters, label_rasters)
+
+    def count_block(blocks):
+        partial = {}
+        for raster_key in rasters:
+            classes = blocks['class', raster_key]
+            valid = (classes >= 0) & (classes < n_classes)
+            if nodata[raster_key] is not None:
+                valid &= classes != nodata[raster_key]
+            # (n_zones + 1) * n_classes fits in uint32, so the keys stay 4 bytes per pixel
+            classes = classes[valid].astype(np.uint32)
+            for zone_key in label_rasters:
+                keys = blocks['zone', zone_key][valid].astype(np.uint32)
+                keys *= n_classes
+                keys += classes
+                partial[zone_key, raster_key] = np.bincount(keys, minlength=(n_zones[zone_key] + 1) * n_classes)
+        return partial
+
+    counts = {(zone_key, raster_key): np.zeros((n_zones[zone_key] + 1) * n_classes, dtype=np.int64)
+              for zone_key in label_rasters for raster_key in rasters}
+    for partial in stream_blocks(paths, windows, count_block, workers):
+        for key, block_counts in partial.items():
+            counts[key] += block_counts
+    return {key: c.reshape(n_zones[key[0]] + 1, n_classes) for key, c in counts.items()}
+
+
+def zonal_transitions(raster_from, raster_to, label_rasters, n_classes, workers=None):
+    """
+    From -> to pixel counts per zone between two co-registered class rasters, in one streaming pass.
+
+    Both rasters and all label rasters are read together block by block and counted with
+    np.bincount on (zone, class_from, class_to) keys. Returns {zone key: counts} with counts of
+    shape (n_zones + 1, n_classes + 1, n_classes + 1); index n_classes collects nodata, so the
+    yearly histograms are the marginals of these counts (see transition_marginals).
+    """
+    nodata, n_zones, windows, paths = zonal_inputs({'from': raster_from, 'to': raster_to}, label_rasters)
+    n = n_classes + 1
+
+    def class_index(classes, nodata_value):
+        valid = (classes >= 0) & (classes < n_classes)
+        if nodata_value is not None:
+            valid &= classes != nodata_value
+        return np.where(valid, classes, n_classes).astype(np.uint32)
+
+    def count_block(blocks):
+        pairs = class_index(blocks['class', 'from'], nodata['from'])
+        pairs *= n
+        pairs += class_index(blocks['class', 'to'], nodata['to'])
+        partial = {}
+        for zone_key in label_rasters:
+            # (n_zones + 1) * n * n fits in uint32, so the keys stay 4 bytes per pixel
+            keys = blocks['zone', zone_key].astype(np.uint32)
+            keys *= n * n
+            keys += pairs
+            partial[zone_key] = np.bincount(keys.ravel(), minlength=(n_zones[zone_key] + 1) * n * n)
+        return partial
+
+    counts = {zone_key: np.zeros((n_zones[zone_key] + 1) * n * n, dtype=np.int64) for zone_key in label_rasters}
+    for partial in stream_blocks(paths, windows, count_block, workers):
+        for zone_key, block_counts in partial.items():
+            counts[zone_key] += block_counts
+    return {zone_key: c.reshape(n_zones[zone_key] + 1, n, n) for zone_key, c in counts.items()}
+
+
+def transition_marginals(transitions):
+    """(counts of the first year, counts of the second year) as returned by zonal_histograms."""
+    n_classes = transitions.shape[1] - 1
+    return transitions.sum(axis=2)[:, :n_classes], transitions.sum(axis=1)[:, :n_classes]
+
+
+def transition_frame(transitions, names, pixel_area, zone_type='NUTS0', years=(2012, 2018)):
+    """
+    Area (in hectares) per zone and from -> to ecosystem class pair, one row per non-empty pair.
+    """
+    n_classes = transitions.shape[1] - 1
+    zone_transitions = transitions[1:, :n_classes, :n_classes]
+    zone_idx, from_idx, to_idx = np.nonzero(zone_transitions)
+    zones = np.asarray(names, dtype=object)[zone_idx]
+    df = pd.DataFrame({'Zone': zones})
+    if zone_type == 'NUTS0':
+        df['Country'] = zones
+    elif zone_type == 'NUTS2':
+        df['Region'] = zones
+    df[f'ECO_{years[0]}'] = from_idx
+    df[f'ECO_{years[1]}'] = to_idx
+    df[f'Ecosystem {years[0]}'] = [ecosystem_classes.get(int(k), str(k)) for k in from_idx]
+    df[f'Ecosystem {years[1]}'] = [ecosystem_classes.get(int(k), str(k)) for k in to_idx]
+    df['Area'] = zone_transitions[zone_idx, from_idx, to_idx] * pixel_area
+    return df.sort_values(by=['Zone', f'ECO_{years[0]}', f'ECO_{years[1]}'], ignore_index=True)
+
+
+def transition_columns(df, years=(2012, 2018)):
+    """One row per zone with an ECO_<from>_to_<to> area column per class pair (for GeoJSON export)."""
+    wide = df.pivot_table(index='Zone', columns=[f'ECO_{years[0]}', f'ECO_{years[1]}'], values='Area', aggfunc='sum')
+    wide.columns = [f'ECO_{a}_to_{b}' for a, b in wide.columns]
+    return wide.reset_index()
+
+
+def histogram_frame(counts, names, pixel_area, zone_type='NUTS0'):
+    """
+    Area (in hectares) per ecosystem class and zone from zonal_histograms counts, with the
+    columns of compute_zonal_stats: classes absent from a zone are left empty.
+    """
+    zone_counts = counts[1:]
+    df = pd.DataFrame({'Zone': names})
+    if zone_type == 'NUTS0':
+        df['Country'] = names
+    elif zone_type == 'NUTS2':
+        df['Region'] = names
+    for eco_class in np.nonzero(zone_counts.sum(axis=0))[0]:
+        column = zone_counts[:, eco_class]
+        df[f'ECO_{eco_class}'] = np.where(column > 0, column * pixel_area, np.nan)
+    return df
+
+
 def compute_zonal_stats(raster_file, geojson_file, zone_type='NUTS0'):
     """
     Computes area (in hectares) per ecosystem class within each zone.
-    If the polygon’s bounding window is huge, the function subdivides it into smaller blocks to
-    avoid excessive memory allocation.
-    
+
     zone_type: 'NUTS0' for country-level (uses field "NUTS_NAME"),
                'NUTS2' for region-level (combines "CNTR_CODE" and "NUTS_NAME").
     """
-    import rasterio
-    from rasterio.windows import from_bounds, transform as window_transform_func, Window
-    from rasterio.features import rasterize
-    import geopandas as gpd
-    import numpy as np
-    import pandas as pd
-
-    # Open the raster once to extract general info
     with rasterio.open(raster_file) as src:
         raster_crs = src.crs
-        global_transform = src.transform
-        nodata = src.nodata if src.nodata is not None else 0
         # Calculate pixel area (in hectares)
         pixel_area = abs(src.transform[0]) * abs(src.transform[4]) / 10000
 
-        # Read the GeoJSON file and reproject if necessary
-        gdf = gpd.read_file(geojson_file)
-        if gdf.crs != raster_crs:
-            gdf = gdf.to_crs(raster_crs)
-
-        stats_list = []
-        max_block = 1000  # maximum block size to process at one time
-        for idx, row in gdf.iterrows():
-            geom = row.geometry
-            # Define zone name based on zone type
-            if zone_type == 'NUTS0':
-                zone_name = row.get('NUTS_NAME', f'zone_{idx}')
-            elif zone_type == 'NUTS2':
-                cntr = row.get('CNTR_CODE', '')
-                nuts_name = row.get('NUTS_NAME', '')
-                zone_name = f"{cntr}_{nuts_name}"
-            else:
-                zone_name = f'zone_{idx}'
-
-            # Determine the window that covers the geometry bounds
-            bounds = geom.bounds  # (minx, miny, maxx, maxy)
-            window = from_bounds(*bounds, transform=global_transform)
-            window = window.round_offsets().round_lengths()
-
-            # Get window dimensions
-            w_width = int(window.width)
-            w_height = int(window.height)
-            area_counts = {}  # accumulator for pixel counts for each ecosystem class
-
-            if w_width > max_block or w_height > max_block:
-                # Subdivide the window into smaller tiles
-                for row_off in range(0, w_height, max_block):
-                    for col_off in range(0, w_width, max_block):
-                        tile_width = min(max_block, w_width - col_off)
-                        tile_height = min(max_block, w_height - row_off)
-                        # Create a sub-window relative to the full raster
-                        tile_window = Window(window.col_off + col_off, window.row_off + row_off, tile_width, tile_height)
-                        # Read only this tile
-                        data_tile = src.read(1, window=tile_window, boundless=True, fill_value=nodata)
-                        # Get transform for this tile
-                        tile_transform = rasterio.windows.transform(tile_window, global_transform)
-                        # Rasterize the geometry over this tile
-                        out_shape = data_tile.shape
-                        tile_mask = rasterize(
-                            [(geom, 1)],
-                            out_shape=out_shape,
-                            transform=tile_transform,
-                            fill=0,
-                            dtype='uint8'
-                        )
-                        masked_tile = np.where(tile_mask == 1, data_tile, nodata)
-                        valid_tile = masked_tile[masked_tile != nodata]
-                        if valid_tile.size > 0:
-                            unique, counts = np.unique(valid_tile, return_counts=True)
-                            for k, c in zip(unique, counts):
-                                area_counts[int(k)] = area_counts.get(int(k), 0) + c
-            else:
-                # Process the entire window at once
-                data = src.read(1, window=window, boundless=True, fill_value=nodata)
-                win_transform = window_transform_func(window, global_transform)
-                out_shape = data.shape
-                mask = rasterize(
-                    [(geom, 1)],
-                    out_shape=out_shape,
-                    transform=win_transform,
-                    fill=0,
-                    dtype='uint8'
-                )
-                masked_data = np.where(mask == 1, data, nodata)
-                valid_data = masked_data[masked_data != nodata]
-                if valid_data.size > 0:
-                    unique, counts = np.unique(valid_data, return_counts=True)
-                    for k, c in zip(unique, counts):
-                        area_counts[int(k)] = area_counts.get(int(k), 0) + c
-
-            # Convert counts to area (in hectares)
-            area_dict = {k: v * pixel_area for k, v in area_counts.items()}
-
-            # Prepare result record for the zone
-            result = {'Zone': zone_name}
-            if zone_type == 'NUTS0':
-                result['Country'] = zone_name
-            elif zone_type == 'NUTS2':
-                result['Region'] = zone_name
-            for eco_class, area in area_dict.items():
-                result[f'ECO_{eco_class}'] = area
-            stats_list.append(result)
-    df = pd.DataFrame(stats_list)
-    return df
+    label_raster = zone_label_raster(geojson_file, raster_file)
+    counts = zonal_histograms({0: raster_file}, {0: label_raster}, n_level1_classes)
+    names = zone_names(read_zones(geojson_file, raster_crs), zone_type)
+    return histogram_frame(counts[0, 0], names, pixel_area, zone_type)
 
 def ensure_numeric(df):
     for col in df.columns:
@@ -236,18 +482,36 @@ raster_2018_input = "U2018_CLC2018_v2020_20u1.tif"
 
 raster_2012_output = "2012_level1_EA.tif"
 raster_2018_output = "2018_level1_EA.tif"
+raster_2012_level2_output = "2012_level2_EA.tif"
+raster_2018_level2_output = "2018_level2_EA.tif"
 
-print("Reclassifying rasters to level1 ...")
-reclassify_raster_level1(raster_2012_input, raster_2012_output)
-reclassify_raster_level1(raster_2018_input, raster_2018_output)
+print("Reclassifying rasters to level1 and level2 ...")
+reclassify_raster(raster_2012_input, {0: raster_2012_output, 1: raster_2012_level2_output})
+reclassify_raster(raster_2018_input, {0: raster_2018_output, 1: raster_2018_level2_output})
 
 # ----- Compute zonal statistics based on geojson files -----
 # Geojson files (ensure they are correctly formatted)
 nuts0_file = "NUTS0_3M_EUROPE.geojson"  # Country-level boundaries; uses field NUTS_NAME
 nuts2_file = "NUTS2_3M_EUROPE.geojson"  # Regional boundaries; combines CNTR_CODE and NUTS_NAME
-print("Computing zonal statistics for NUTS0 (countries) ...")
-stats_2012_country = compute_zonal_stats(raster_2012_output, nuts0_file, zone_type='NUTS0')
-stats_2018_country = compute_zonal_stats(raster_2018_output, nuts0_file, zone_type='NUTS0')
+zone_files = {'NUTS0': nuts0_file, 'NUTS2': nuts2_file}
+year_rasters = {2012: raster_2012_output, 2018: raster_2018_output}
+
+# The 2012 -> 2018 change matrices of both NUTS levels come from one pass over the level1 rasters;
+# the yearly zonal statistics are their marginals
+print("Computing change matrices and zonal statistics for NUTS0 (countries) and NUTS2 (regions) ...")
+label_rasters = {zone_type: zone_label_raster(path, raster_2012_output) for zone_type, path in zone_files.items()}
+transitions = zonal_transitions(raster_2012_output, raster_2018_output, label_rasters, n_level1_classes)
+zone_counts = {}
+for zone_type, zone_transitions in transitions.items():
+    zone_counts[zone_type, 2012], zone_counts[zone_type, 2018] = transition_marginals(zone_transitions)
+
+with rasterio.open(raster_2012_output) as src:
+    raster_crs = src.crs
+    pixel_area = abs(src.transform[0]) * abs(src.transform[4]) / 10000
+names = {zone_type: zone_names(read_zones(path, raster_crs), zone_type) for zone_type, path in zone_files.items()}
+
+stats_2012_country = histogram_frame(zone_counts['NUTS0', 2012], names['NUTS0'], pixel_area, zone_type='NUTS0')
+stats_2018_country = histogram_frame(zone_counts['NUTS0', 2018], names['NUTS0'], pixel_area, zone_type='NUTS0')
 
 # Ensure numeric types
 stats_2012_country = ensure_numeric(stats_2012_country)
@@ -255,9 +519,8 @@ stats_2018_country = ensure_numeric(stats_2018_country)
 
 diff_country = compute_difference(stats_2012_country, stats_2018_country, key='Zone')
 
-print("Computing zonal statistics for NUTS2 (regions) ...")
-stats_2012_nuts2 = compute_zonal_stats(raster_2012_output, nuts2_file, zone_type='NUTS2')
-stats_2018_nuts2 = compute_zonal_stats(raster_2018_output, nuts2_file, zone_type='NUTS2')
+stats_2012_nuts2 = histogram_frame(zone_counts['NUTS2', 2012], names['NUTS2'], pixel_area, zone_type='NUTS2')
+stats_2018_nuts2 = histogram_frame(zone_counts['NUTS2', 2018], names['NUTS2'], pixel_area, zone_type='NUTS2')
 
 # Ensure numeric types
 stats_2012_nuts2 = ensure_numeric(stats_2012_nuts2)
@@ -358,6 +621,10 @@ stats_2018_country = add_share_columns(stats_2018_country)
 stats_2012_nuts2 = add_share_columns(stats_2012_nuts2)
 stats_2018_nuts2 = add_share_columns(stats_2018_nuts2)
 
+# From -> to areas per zone
+change_country = transition_frame(transitions['NUTS0'], names['NUTS0'], pixel_area, zone_type='NUTS0')
+change_nuts2 = transition_frame(transitions['NUTS2'], names['NUTS2'], pixel_area, zone_type='NUTS2')
+
 # ----- Export results to an Excel workbook -----
 output_excel = "ecosystem_areas_comparison.xlsx"
 with pd.ExcelWriter(output_excel) as writer:
@@ -367,6 +634,8 @@ with pd.ExcelWriter(output_excel) as writer:
     stats_2012_nuts2.to_excel(writer, sheet_name="NUTS2_2012", index=False)
     stats_2018_nuts2.to_excel(writer, sheet_name="NUTS2_2018", index=False)
     diff_nuts2.to_excel(writer, sheet_name="NUTS2_Diff", index=False)
+    change_country.to_excel(writer, sheet_name="Country_Change", index=False)
+    change_nuts2.to_excel(writer, sheet_name="NUTS2_Change", index=False)
 
 def export_geojson(geojson_input, df, output_file, zone_type='NUTS0'):
     gdf = gpd.read_file(geojson_input)
@@ -396,4 +665,7 @@ export_geojson(nuts2_file, stats_2012_nuts2, 'NUTS2_2012.geojson', zone_type='NU
 export_geojson(nuts2_file, stats_2018_nuts2, 'NUTS2_2018.geojson', zone_type='NUTS2')
 export_geojson(nuts2_file, diff_nuts2, '2018_2012_NUTS2_Diff.geojson', zone_type='NUTS2')
 
+export_geojson(nuts0_file, transition_columns(change_country), '2012_2018_Country_Change.geojson', zone_type='NUTS0')
+export_geojson(nuts2_file, transition_columns(change_nuts2), '2012_2018_NUTS2_Change.geojson', zone_type='NUTS2')
+
 print("Processing complete. New TIFF files, Excel report, and GeoJSON outputs with share columns generated.")
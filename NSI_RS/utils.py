@@ -1,13 +1,29 @@
 import json
+import random
+import asyncio
+import hashlib
+import concurrent.futures
+import aiohttp
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
-import requests
 import zipfile
 import os
 import xarray as xr
 import cdsapi
 
+# Sentinel Hub Statistical API
+STATISTICS_URL = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
+# Keš odgovora (ključ je SHA-256 tela zahteva), omogućava ponovno pokretanje bez mreže
+STATS_CACHE_DIR = "/home/eouser/Desktop/VRI/data/stats_cache"
+MAX_CONCURRENT_REQUESTS = 8
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 2.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Izlazi evalscript-a čije kolone nemaju prefiks, i statistike koje se čuvaju po kanalu
+DEFAULT_OUTPUTS = ("default", "data")
+DEFAULT_STATS = ("min", "max", "mean", "stDev")
+
 def get_eval_script(key):
     with open("/home/eouser/Desktop/VRI/data/evalscripts.json", "r") as json_file:
         scripts = json.load(json_file)
@@ -48,19 +64,14 @@ def plot_time_series(df_grouped, ylabel="Srednja vrednost", title="Vremenska ser
     plt.grid(True)
     plt.show()
     
-def fetch_data_for_ndvi_year(year, bbox, evalscript,token):
-    # API URL
-    url = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
-    # API zaglavlja
-    headers = {
-        "Content-Type": "application/json",
-        'Accept': 'application/json',
-        "Authorization": token
-    }
-    stats_request = {
+def stats_request(year, bbox, evalscript):
+    """
+    Telo zahteva za Statistical API: mesečna (P30D) statistika za jednu godinu i bbox.
+    """
+    return {
         "input": {
             "bounds": {
-                "bbox": bbox
+                "bbox": list(bbox)
             },
             "data": [
                 {
@@ -99,160 +110,187 @@ def fetch_data_for_ndvi_year(year, bbox, evalscript,token):
         }
     }
 
-    response = requests.post(url, headers=headers, json=stats_request)
-    
-    # Provera statusnog koda API odgovora
-    if response.status_code != 200:
-        print(f"⚠️ Greška u zahtevu za {year}: {response.status_code}")
-        print(f"Odgovor API-ja: {response.text}")
-        return pd.DataFrame()
-    
-    sh_statistics = response.json()
 
-    # Provera API odgovora pre obrade podataka
-    if "data" not in sh_statistics:
-        print(f"⚠️ Nema podataka za {year}. API odgovor: {sh_statistics}")
-        return pd.DataFrame()
+def run_sync(coroutine):
+    """
+    Izvršava korutinu i iz Jupyter-a, gde event loop već radi (tada u zasebnoj niti).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
 
-    # Transformacija podataka u listu rečnika
-    data = data = [
-        {
-            "from": entry["interval"]["from"],
-            "to": entry["interval"]["to"],
-            "B0_min": entry["outputs"]["data"]["bands"]["B0"]["stats"]["min"],
-            "B0_max": entry["outputs"]["data"]["bands"]["B0"]["stats"]["max"],
-            "B0_mean": entry["outputs"]["data"]["bands"]["B0"]["stats"]["mean"],
-            "B0_stDev": entry["outputs"]["data"]["bands"]["B0"]["stats"]["stDev"],
-            "B1_min": entry["outputs"]["data"]["bands"]["B1"]["stats"]["min"],
-            "B1_max": entry["outputs"]["data"]["bands"]["B1"]["stats"]["max"],
-            "B1_mean": entry["outputs"]["data"]["bands"]["B1"]["stats"]["mean"],
-            "B1_stDev": entry["outputs"]["data"]["bands"]["B1"]["stats"]["stDev"],
-            "B2_min": entry["outputs"]["data"]["bands"]["B2"]["stats"]["min"],
-            "B2_max": entry["outputs"]["data"]["bands"]["B2"]["stats"]["max"],
-            "B2_mean": entry["outputs"]["data"]["bands"]["B2"]["stats"]["mean"],
-            "B2_stDev": entry["outputs"]["data"]["bands"]["B2"]["stats"]["stDev"],
-            "year": year
-        }
-        for entry in sh_statistics["data"]
-    ]
 
-    return pd.DataFrame(data)
+class StatisticsClient:
+    """
+    Statistical API klijent: jedna sesija sa bazenom konekcija, istovremeni zahtevi i keš odgovora na disku.
 
+    Keš je adresiran sadržajem: ključ je SHA-256 tela zahteva, pa se isti zahtev (godina, bbox,
+    evalscript) nikad ne šalje dvaput. Sa offline=True koristi se samo keš.
+    """
 
-def fetch_data_for_moisi_year(year,bbox,evalscript,token):
-    # API URL
-    url = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
-    # API zaglavlja
-    headers = {
-        "Content-Type": "application/json",
-        'Accept': 'application/json',
-        "Authorization": token
-    }
-    stats_request = {
-        "input": {
-            "bounds": {
-                "bbox": bbox},
-            "data": [
-                {
-                    "dataFilter": {
-                        "mosaickingOrder": "leastCC"
-                    },
-                    "type": "sentinel-2-l2a"
-                }
-            ]
-        },
-        "aggregation": {
-            "timeRange": {
-                "from": f"{year}-01-01T00:00:00Z",
-                "to": f"{year}-12-31T23:59:59Z"
-            },
-            "aggregationInterval": {
-                "of": "P30D"
-            },
-            # "width": 512,
-            # "height": 454.057,
-            "width": 256,
-            "height": 227,
-            "evalscript": evalscript
-        },
-        "calculations": {
-            "default": {
-                "statistics": {
-                    "default": {
-                        "percentiles": {
-                            "k": [25, 50, 75],
-                            "interpolation": "higher"
-                        }
-                    }
-                }
-            }
+    def __init__(self, token, cache_dir=STATS_CACHE_DIR, max_concurrent=MAX_CONCURRENT_REQUESTS,
+                 url=STATISTICS_URL, offline=False):
+        self.token = token
+        self.cache_dir = cache_dir
+        self.max_concurrent = max_concurrent
+        self.url = url
+        self.offline = offline
+
+    def cache_path(self, body):
+        key = hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def cached(self, body):
+        path = self.cache_path(body)
+        if os.path.exists(path):
+            with open(path, "r") as json_file:
+                return json.load(json_file)
+        return None
+
+    def store(self, body, sh_statistics):
+        path = self.cache_path(body)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "w") as json_file:
+            json.dump(sh_statistics, json_file)
+        os.replace(path + ".part", path)
+
+    async def post(self, session, body):
+        sh_statistics = self.cached(body)
+        if sh_statistics is not None or self.offline:
+            return sh_statistics
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                async with session.post(self.url, json=body) as response:
+                    if response.status == 200:
+                        sh_statistics = await response.json()
+                        # Samo kompletni odgovori idu u keš
+                        if "data" in sh_statistics:
+                            self.store(body, sh_statistics)
+                        return sh_statistics
+                    if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES - 1:
+                        print(f"⚠️ Greška u zahtevu: {response.status}")
+                        print(f"Odgovor API-ja: {await response.text()}")
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # Uključuje i odgovore 200 čije telo nije JSON (ContentTypeError)
+                if attempt == MAX_RETRIES - 1:
+                    print(f"⚠️ Zahtev nije uspeo: {e!r}")
+                    return None
+            await asyncio.sleep(BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random()))
+
+    async def fetch_many(self, bodies):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": self.token
         }
-    }
+        connector = aiohttp.TCPConnector(limit=self.max_concurrent)
+        async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                         timeout=aiohttp.ClientTimeout(total=600)) as session:
+            responses = await asyncio.gather(*(self.post(session, body) for body in bodies), return_exceptions=True)
+        # Jedan neuspeli zahtev ne obara ceo skup
+        for response in responses:
+            if isinstance(response, Exception):
+                print(f"⚠️ Zahtev nije uspeo: {response!r}")
+        return [None if isinstance(response, Exception) else response for response in responses]
+
+    def fetch(self, bodies):
+        """
+        Odgovori (ili None) za listu tela zahteva, istim redosledom.
+        """
+        return run_sync(self.fetch_many(bodies))
+
+
+def flatten_statistics(sh_statistics, stats=DEFAULT_STATS):
+    """
+    Pretvara odgovor Statistical API-ja u listu redova, za bilo koji broj izlaza i kanala.
+
+    Kolone su <kanal>_<stat> za izlaze "default"/"data", <izlaz>_<stat> za izlaz sa jednim kanalom B0,
+    inače <izlaz>_<kanal>_<stat>. Sa stats=None uzimaju se sve statistike (percentili kao <stat>_<k>).
+    """
+    rows = []
+    for entry in sh_statistics.get("data", []):
+        row = {"from": entry["interval"]["from"], "to": entry["interval"]["to"]}
+        for output, output_stats in entry.get("outputs", {}).items():
+            bands = output_stats.get("bands", {})
+            for band, band_stats in bands.items():
+                if output in DEFAULT_OUTPUTS:
+                    prefix = band
+                elif len(bands) == 1 and band == "B0":
+                    prefix = output
+                else:
+                    prefix = f"{output}_{band}"
+                values = band_stats.get("stats", {})
+                for stat in (stats or values):
+                    value = values.get(stat)
+                    if isinstance(value, dict):
+                        row.update({f"{prefix}_{stat}_{k}": v for k, v in value.items()})
+                    else:
+                        row[f"{prefix}_{stat}"] = value
+        rows.append(row)
+    return rows
+
+
+def fetch_statistics(years, bboxes, evalscripts, token, client=None, stats=DEFAULT_STATS):
+    """
+    Statistika za svaku kombinaciju (godina × bbox × evalscript), preuzeta istovremeno.
+
+    :param bboxes: Rečnik {NUTS3 kod: bbox}
+    :param evalscripts: Rečnik {naziv: evalscript}
+    :param client: StatisticsClient (podrazumevano novi, sa kešom u STATS_CACHE_DIR)
+    :return: Rečnik {naziv evalscript-a: DataFrame sa kolonama 'year' i 'nuts3'}
+    """
+    client = client or shared_client(token)
+    jobs = [(year, nuts3, name) for name in evalscripts for nuts3 in bboxes for year in years]
+    responses = client.fetch([stats_request(year, bboxes[nuts3], evalscripts[name]) for year, nuts3, name in jobs])
+
+    rows = {name: [] for name in evalscripts}
+    for (year, nuts3, name), sh_statistics in zip(jobs, responses):
+        if not sh_statistics or "data" not in sh_statistics:
+            print(f"⚠️ Nema podataka za {name}, {nuts3}, {year}. API odgovor: {sh_statistics}")
+            continue
+        rows[name].extend(dict(row, year=year, nuts3=nuts3) for row in flatten_statistics(sh_statistics, stats))
+    return {name: pd.DataFrame(name_rows) for name, name_rows in rows.items()}
+
+
+_clients = {}
+
+
+def shared_client(token):
+    """
+    Jedan StatisticsClient po tokenu, zajednički za sve pozive fetch_data_for_*_year.
+    """
+    if token not in _clients:
+        _clients[token] = StatisticsClient(token)
+    return _clients[token]
 
-    response = requests.post(url, headers=headers, json=stats_request)
-    sh_statistics = response.json()
 
-    # Provera da li API odgovor sadrži "data"
-    if "data" not in sh_statistics:
+def fetch_statistics_year(year, bbox, evalscript, token):
+    sh_statistics = shared_client(token).fetch([stats_request(year, bbox, evalscript)])[0]
+
+    # Provera API odgovora pre obrade podataka
+    if not sh_statistics or "data" not in sh_statistics:
         print(f"⚠️ Nema podataka za {year}. API odgovor: {sh_statistics}")
-        return pd.DataFrame()  # Vraća prazan DataFrame ako nema podataka
+        return None
+    return flatten_statistics(sh_statistics)
 
-    data = []
-    
-    for entry in sh_statistics["data"]:
-        interval_from = entry["interval"]["from"]
-        interval_to = entry["interval"]["to"]
-        
-        # Accessing 'default' band statistics
-        default_bands = entry["outputs"].get("default", {}).get("bands", {})
-        B0_stats = default_bands.get("B0", {}).get("stats", {})
-        B1_stats = default_bands.get("B1", {}).get("stats", {})
-        B2_stats = default_bands.get("B2", {}).get("stats", {})
-        B3_stats = default_bands.get("B3", {}).get("stats", {})
-        
-        # Accessing 'index' band statistics
-        index_bands = entry["outputs"].get("index", {}).get("bands", {})
-        index_stats = index_bands.get("B0", {}).get("stats", {})
-        
-        # Accessing 'eobrowserStats' band statistics
-        eobrowser_stats_bands = entry["outputs"].get("eobrowserStats", {}).get("bands", {})
-        eobrowser_B0_stats = eobrowser_stats_bands.get("B0", {}).get("stats", {})
-        eobrowser_B1_stats = eobrowser_stats_bands.get("B1", {}).get("stats", {})
-        
-        data.append({
-            "from": interval_from,
-            "to": interval_to,
-            "B0_min": B0_stats.get("min"),
-            "B0_max": B0_stats.get("max"),
-            "B0_mean": B0_stats.get("mean"),
-            "B0_stDev": B0_stats.get("stDev"),
-            "B1_min": B1_stats.get("min"),
-            "B1_max": B1_stats.get("max"),
-            "B1_mean": B1_stats.get("mean"),
-            "B1_stDev": B1_stats.get("stDev"),
-            "B2_min": B2_stats.get("min"),
-            "B2_max": B2_stats.get("max"),
-            "B2_mean": B2_stats.get("mean"),
-            "B2_stDev": B2_stats.get("stDev"),
-            "B3_min": B3_stats.get("min"),
-            "B3_max": B3_stats.get("max"),
-            "B3_mean": B3_stats.get("mean"),
-            "B3_stDev": B3_stats.get("stDev"),
-            "index_min": index_stats.get("min"),
-            "index_max": index_stats.get("max"),
-            "index_mean": index_stats.get("mean"),
-            "index_stDev": index_stats.get("stDev"),
-            "eobrowserStats_B0_min": eobrowser_B0_stats.get("min"),
-            "eobrowserStats_B0_max": eobrowser_B0_stats.get("max"),
-            "eobrowserStats_B0_mean": eobrowser_B0_stats.get("mean"),
-            "eobrowserStats_B0_stDev": eobrowser_B0_stats.get("stDev"),
-            "eobrowserStats_B1_min": eobrowser_B1_stats.get("min"),
-            "eobrowserStats_B1_max": eobrowser_B1_stats.get("max"),
-            "eobrowserStats_B1_mean": eobrowser_B1_stats.get("mean"),
-            "eobrowserStats_B1_stDev": eobrowser_B1_stats.get("stDev"),
-        })
-    
-    return pd.DataFrame(data)
+
+def fetch_data_for_ndvi_year(year, bbox, evalscript,token):
+    rows = fetch_statistics_year(year, bbox, evalscript, token)
+    if rows is None:
+        return pd.DataFrame()
+    return pd.DataFrame([dict(row, year=year) for row in rows])
+
+
+def fetch_data_for_moisi_year(year,bbox,evalscript,token):
+    rows = fetch_statistics_year(year, bbox, evalscript, token)
+    if rows is None:
+        return pd.DataFrame()  # Vraća prazan DataFrame ako nema podataka
+    return pd.DataFrame(rows)
 
 
 def read_grib_from_zip(zip_path, extract_path, output_csv=None):
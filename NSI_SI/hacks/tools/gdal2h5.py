@@ -4,6 +4,12 @@
 @author: Alen Mangafić
 """
 import os
+import json
+import zlib
+import importlib
+import threading
+import concurrent.futures
+from collections import deque
 import h5py
 import rasterio
 import numpy as np
@@ -14,8 +20,21 @@ bands_directory = "/path/to/s2/vrt"
 label_file = "/path/to/classification/S2GLC_Europe_2017_clipped_20m.tif"
 output_h5 = "/path/to/wherever/ard.h5"
 
-compression_type = "gzip"
-tile_size = 256  
+compression_type = "gzip"  # "gzip", "lz4" (needs lz4 + hdf5plugin) or "blosc-zstd" (needs blosc + hdf5plugin)
+compression_level = 4
+tile_size = 256
+
+# Pipeline: reader threads read one tile from every raster, compressor threads
+# encode the chunks (zlib/lz4/blosc release the GIL) and the main thread writes them
+n_readers = 4
+n_compressors = os.cpu_count()
+max_tiles_in_flight = 4 * n_compressors
+
+# Progress journal: the next tile to write, saved every few tiles after a flush.
+# An interrupted run resumes from there; the journal is removed once done.
+journal_path = output_h5 + ".journal"
+journal_every = 64
+
 
 def window_generator(width, height, tile_size):
     """Yield rasterio Windows for chunked reading."""
@@ -25,35 +44,164 @@ def window_generator(width, height, tile_size):
             win_height = min(tile_size, height - row_off)
             yield Window(col_off, row_off, win_width, win_height), (row_off, col_off, win_height, win_width)
 
+
+def h5_filter(compression_type, level):
+    """create_dataset() keyword arguments declaring the chunk filter."""
+    if compression_type == "gzip":
+        return {"compression": "gzip", "compression_opts": level}
+    import hdf5plugin
+    if compression_type == "lz4":
+        return dict(hdf5plugin.LZ4())
+    if compression_type == "blosc-zstd":
+        return dict(hdf5plugin.Blosc(cname="zstd", clevel=level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise Exception(f"Unknown compression type: {compression_type}")
+
+
+# Packages each codec needs to write chunks (hdf5plugin declares the filter and is needed to read them back)
+codec_packages = {"gzip": [], "lz4": ["lz4.block", "hdf5plugin"], "blosc-zstd": ["blosc", "hdf5plugin"]}
+
+
+def check_codec(compression_type):
+    """Fail before any data is read if the chosen codec is unknown or its packages are missing."""
+    if compression_type not in codec_packages:
+        raise Exception(f"Unknown compression type: {compression_type}")
+    missing = []
+    for package in codec_packages[compression_type]:
+        try:
+            importlib.import_module(package)
+        except ImportError:
+            missing.append(package.split(".")[0])
+    if missing:
+        raise Exception(f"Compression type {compression_type} needs: pip install {' '.join(missing)}")
+
+
+def encode_chunk(block, compression_type, level):
+    """Compress one full chunk into the byte layout the HDF5 filter expects."""
+    raw = np.ascontiguousarray(block).tobytes()
+    if compression_type == "gzip":
+        return zlib.compress(raw, level)
+    if compression_type == "lz4":
+        # HDF5 LZ4 filter: total size, block size, then (compressed size, bytes) per block
+        import lz4.block
+        header = len(raw).to_bytes(8, "big") + len(raw).to_bytes(4, "big")
+        packed = lz4.block.compress(raw, store_size=False)
+        if len(packed) >= len(raw):
+            packed = raw
+        return header + len(packed).to_bytes(4, "big") + packed
+    import blosc
+    return blosc.compress(raw, typesize=block.dtype.itemsize, clevel=level,
+                          shuffle=blosc.SHUFFLE, cname="zstd")
+
+
+check_codec(compression_type)
+
 # Get VRT files
 vrt_files = sorted(f for f in os.listdir(bands_directory) if f.endswith(".vrt"))
 if not vrt_files:
     raise Exception("No VRT files found.")
 
-with h5py.File(output_h5, "w") as h5f:
-    for file_name in vrt_files:
-        file_path = os.path.join(bands_directory, file_name)
-        parts = file_name.split('_')
-        dataset_name = f"{parts[1]}_{parts[0]}" if len(parts) >= 3 else os.path.splitext(file_name)[0]
-
-        with rasterio.open(file_path) as src:
-            height, width = src.height, src.width
-            dset = h5f.create_dataset(
-                dataset_name, shape=(height, width), dtype="float32",
-                chunks=(tile_size, tile_size), compression=compression_type
+# (dataset name, source path, dtype, fill value); zeros in the bands become NaN
+sources = []
+for file_name in vrt_files:
+    parts = file_name.split('_')
+    dataset_name = f"{parts[1]}_{parts[0]}" if len(parts) >= 3 else os.path.splitext(file_name)[0]
+    sources.append((dataset_name, os.path.join(bands_directory, file_name), np.float32, np.nan))
+sources.append(("labels_2017", label_file, np.uint8, 0))
+
+shapes = []
+for _, path, _, _ in sources:
+    with rasterio.open(path) as src:
+        shapes.append((src.height, src.width))
+height = max(h for h, _ in shapes)
+width = max(w for _, w in shapes)
+tiles = [offsets for _, offsets in window_generator(width, height, tile_size)]
+
+journal = {
+    "sources": [path for _, path, _, _ in sources],
+    "tile_size": tile_size,
+    "compression": [compression_type, compression_level],
+    "next_tile": 0,
+}
+start_tile = 0
+if os.path.exists(journal_path) and os.path.exists(output_h5):
+    with open(journal_path) as f:
+        saved = json.load(f)
+    if {k: v for k, v in saved.items() if k != "next_tile"} == {k: v for k, v in journal.items() if k != "next_tile"}:
+        start_tile = saved["next_tile"]
+        print(f"Resuming at tile {start_tile} of {len(tiles)}")
+
+
+def save_journal(next_tile):
+    journal["next_tile"] = next_tile
+    with open(journal_path + ".tmp", "w") as f:
+        json.dump(journal, f)
+    os.replace(journal_path + ".tmp", journal_path)
+
+
+# Every reader thread keeps its own handles (rasterio datasets are not thread-safe)
+local = threading.local()
+opened = []
+opened_lock = threading.Lock()
+
+
+def read_tile(index, compressors):
+    """Read one tile from every source and queue the chunks for compression."""
+    if not hasattr(local, "handles"):
+        local.handles = [rasterio.open(path) for _, path, _, _ in sources]
+        with opened_lock:
+            opened.extend(local.handles)
+
+    row_off, col_off, _, _ = tiles[index]
+    chunks = []
+    for (name, _, dtype, fill), src, (h, w) in zip(sources, local.handles, shapes):
+        if row_off >= h or col_off >= w:
+            continue
+        win_height, win_width = min(tile_size, h - row_off), min(tile_size, w - col_off)
+        data_block = src.read(1, window=Window(col_off, row_off, win_width, win_height)).astype(dtype)
+        if dtype == np.float32:
+            data_block[data_block == 0] = np.nan
+
+        # Direct chunk writes always take a full chunk; pad edge tiles with the fill value
+        chunk = np.full((tile_size, tile_size), fill, dtype=dtype)
+        chunk[:win_height, :win_width] = data_block
+        chunks.append((name, compressors.submit(encode_chunk, chunk, compression_type, compression_level)))
+    return chunks
+
+
+with h5py.File(output_h5, "a" if start_tile else "w") as h5f:
+    for (name, _, dtype, fill), (h, w) in zip(sources, shapes):
+        if name not in h5f:
+            h5f.create_dataset(
+                name, shape=(h, w), dtype=dtype, chunks=(tile_size, tile_size),
+                fillvalue=fill, **h5_filter(compression_type, compression_level)
             )
+    if not start_tile:
+        save_journal(0)
+
+    def commit_tile(index, chunks):
+        row_off, col_off, _, _ = tiles[index]
+        for name, encoded in chunks:
+            h5f[name].id.write_direct_chunk((row_off, col_off), encoded.result())
+        if (index + 1) % journal_every == 0:
+            h5f.flush()
+            save_journal(index + 1)
+            print(f"Committed {index + 1}/{len(tiles)} tiles")
 
-            for win, (row_off, col_off, win_height, win_width) in window_generator(width, height, tile_size):
-                data_block = src.read(1, window=win).astype(np.float32)
-                data_block[data_block == 0] = np.nan
-                dset[row_off:row_off+win_height, col_off:col_off+win_width] = data_block
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_compressors) as compressors, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=n_readers) as readers:
+        # Tiles are committed strictly in order, so the journal is a single counter
+        pending = deque()
+        for index in range(start_tile, len(tiles)):
+            pending.append((index, readers.submit(read_tile, index, compressors)))
+            if len(pending) >= max_tiles_in_flight:
+                done_index, chunks = pending.popleft()
+                commit_tile(done_index, chunks.result())
+        while pending:
+            done_index, chunks = pending.popleft()
+            commit_tile(done_index, chunks.result())
 
-    with rasterio.open(label_file) as src:
-        height, width = src.height, src.width
-        dset_label = h5f.create_dataset(
-            "labels_2017", shape=(height, width), dtype="uint8",
-            chunks=(tile_size, tile_size), compression=compression_type
-        )
+    for src in opened:
+        src.close()
 
-        for win, (row_off, col_off, win_height, win_width) in window_generator(width, height, tile_size):
-            dset_label[row_off:row_off+win_height, col_off:col_off+win_width] = src.read(1, window=win).astype(np.uint8)
+os.remove(journal_path)
+print(f"Saved {len(sources)} datasets to {output_h5}")
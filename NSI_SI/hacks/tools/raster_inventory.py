@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent inventory of the reprojected Sentinel-2 tiles and the yearly VRTs.
+
+s2_fetch.py records every band it writes, so the later steps query this
+SQLite file instead of walking /{year}/{band}/*.tif and opening rasters.
+Running this script (re)scans base_dir incrementally: only new or changed
+files are opened and checksummed, and vanished files are dropped.
+"""
+import os
+import glob
+import time
+import hashlib
+import sqlite3
+import rasterio
+
+base_dir = "/media/eouser/..."
+inventory_path = os.path.join(base_dir, "inventory.sqlite")
+years = range(2017, 2024)
+bands = ["B04_20m", "B11_20m", "B12_20m"]
+
+
+def open_inventory(path=inventory_path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS rasters (
+            path TEXT PRIMARY KEY, tile_id TEXT, year INTEGER, band TEXT,
+            minx REAL, miny REAL, maxx REAL, maxy REAL, crs TEXT, res_x REAL, res_y REAL,
+            width INTEGER, height INTEGER, size INTEGER, mtime_ns INTEGER, sha1 TEXT, recorded_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS rasters_band_year ON rasters (band, year);
+        CREATE TABLE IF NOT EXISTS vrts (
+            path TEXT PRIMARY KEY, band TEXT, minx REAL, miny REAL, maxx REAL, maxy REAL,
+            res_x REAL, res_y REAL, n_members INTEGER, built_at REAL
+        );
+    """)
+    return db
+
+
+def tile_id_from_path(path):
+    """Tile ID from a filename like T31UFT_20170610T103019_B04_20m_EPSG3035.tif."""
+    return os.path.basename(path).split("_")[0]
+
+
+def describe(path, tile_id=None, year=None, band=None):
+    """Inventory row of one raster: bounds, CRS, resolution, size and checksum."""
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    with rasterio.open(path) as src:
+        bounds, crs, res, width, height = src.bounds, src.crs, src.res, src.width, src.height
+    return (
+        path, tile_id or tile_id_from_path(path), year, band,
+        bounds.left, bounds.bottom, bounds.right, bounds.top, crs.to_string() if crs else None, res[0], res[1],
+        width, height, stat.st_size, stat.st_mtime_ns, digest.hexdigest(), time.time(),
+    )
+
+
+def record(db, rows):
+    """Insert or replace rows built by ``describe`` (call from one thread only)."""
+    db.executemany(f"INSERT OR REPLACE INTO rasters VALUES ({', '.join('?' * 17)})", rows)
+    db.commit()
+
+
+def update(db, base_dir, years, bands):
+    """Bring the inventory in line with the files under base_dir/{year}/{band}.
+
+    Files whose size and mtime match their row are not opened again.
+    """
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in db.execute("SELECT path, size, mtime_ns FROM rasters")}
+    rows, seen = [], set()
+    for year in years:
+        for band in bands:
+            for path in glob.glob(os.path.join(base_dir, str(year), band, "*.tif")):
+                seen.add(path)
+                stat = os.stat(path)
+                if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                    rows.append(describe(path, year=year, band=band))
+    record(db, rows)
+
+    scanned = {(year, band) for year in years for band in bands}
+    gone = [(path,) for path, year, band in db.execute("SELECT path, year, band FROM rasters")
+            if (year, band) in scanned and path not in seen]
+    db.executemany("DELETE FROM rasters WHERE path = ?", gone)
+    db.commit()
+    print(f"Inventory: {len(rows)} file(s) added or updated, {len(gone)} removed")
+
+
+def tiles(db, year, band):
+    return {row[0] for row in db.execute("SELECT tile_id FROM rasters WHERE year = ? AND band = ?", (year, band))}
+
+
+def common_tiles(db, years, band):
+    """Tile IDs present for ``band`` in every one of ``years``."""
+    years = list(years)
+    query = (f"SELECT tile_id FROM rasters WHERE band = ? AND year IN ({', '.join('?' * len(years))}) "
+             "GROUP BY tile_id HAVING COUNT(DISTINCT year) = ?")
+    return {row[0] for row in db.execute(query, [band, *years, len(years)])}
+
+
+def band_rasters(db, band, years):
+    """Paths of the rasters of ``band`` in ``years`` (the members of its VRT)."""
+    years = list(years)
+    query = f"SELECT path FROM rasters WHERE band = ? AND year IN ({', '.join('?' * len(years))}) ORDER BY year, path"
+    return [row[0] for row in db.execute(query, [band, *years])]
+
+
+def record_vrt(db, path, band, extent, resolution, n_members):
+    """Record the extent and resolution of a built VRT (read from the VRT itself)."""
+    db.execute("INSERT OR REPLACE INTO vrts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+               (os.path.realpath(path), band, *extent, *resolution, n_members, time.time()))
+    db.commit()
+
+
+def vrt_extents(db):
+    """{real VRT path: (minx, miny, maxx, maxy, res_x, res_y, built_at)} as recorded when they were built."""
+    return {os.path.realpath(row[0]): tuple(row[1:])
+            for row in db.execute("SELECT path, minx, miny, maxx, maxy, res_x, res_y, built_at FROM vrts")}
+
+
+def raster_grids(db, band):
+    """(CRS, res_x, res_y, count) groups of a band; more than one group means mixed grids."""
+    return db.execute(
+        "SELECT crs, res_x, res_y, COUNT(*) FROM rasters WHERE band = ? GROUP BY crs, res_x, res_y", (band,)
+    ).fetchall()
+
+
+if __name__ == "__main__":
+    db = open_inventory(inventory_path)
+    update(db, base_dir, years, bands)
+    db.close()
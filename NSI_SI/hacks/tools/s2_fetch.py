@@ -3,137 +3,296 @@
 """
 @author: Alen Mangafić
 """
-import requests
+import os
+import json
+import time
 import pickle
-import rasterio
+import random
+import sqlite3
+import asyncio
 import concurrent.futures
-import time
+from urllib.parse import urlparse
+import aiohttp
+import numpy as np
+import rasterio
+import rasterio.shutil
+import raster_inventory
+from rasterio.errors import RasterioIOError
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.crs import CRS
 
-# STAC API and processing parameters
-BASE_URL = "https://stac.dataspace.copernicus.eu/v1/search"
+# STAC API and processing parameters (STAC_URL can point to a local stub server)
+BASE_URL = os.environ.get("STAC_URL", "https://stac.dataspace.copernicus.eu/v1/search")
 bands = ['B12_20m', 'B11_20m', 'B04_20m']
 output_crs = CRS.from_epsg(3035)
 years = range(2023, 2024)
+output_root = "/path/to"
+
+# Append-only ledger of searched years, STAC items and processed bands
+ledger_path = "/path/to/s2_fetch.sqlite"
+# Old pickle ledger, imported into the SQLite ledger on the first run
 processed_tiles_path = "/path/to/processed_tiles.pkl"
+# Raster inventory queried by min_common_tiles.py, s2bands_to_yearly_vrt.py and vrt_extent_check.py
+inventory_path = f"{output_root}/inventory.sqlite"
 
-# Load processed tiles
-if os.path.exists(processed_tiles_path):
-    with open(processed_tiles_path, 'rb') as f:
-        processed_tiles = pickle.load(f)
-else:
-    processed_tiles = set()
+# Concurrency: STAC connections, bands reprojected at once, and reads per S3 host
+stac_connections = 8
+band_workers = 16
+per_host_limit = 8
 
-for year in years:
-    pickle_path = f"/path/to/{year}_query.pkl"
-    all_features = []
+# Warping: GDAL block cache (MB) and threads per band, tile size of the output COGs
+gdal_cache_mb = 512
+warp_threads = 2
+cog_blocksize = 512
 
-    # Load previous queries
-    if os.path.exists(pickle_path):
-        print(f"Loading saved features for {year}")
-        with open(pickle_path, 'rb') as f:
-            all_features = pickle.load(f)
-
-    # Query STAC if no saved data
-    if not all_features:
-        print(f"Fetching new data for {year}...")
-        query = {
-            "collections": ["sentinel-2-l2a"],
-            "datetime": f"{year}-05-01T00:00:00Z/{year}-06-01T23:59:59Z",
-            "limit": 1000,
-            "query": {"eo:cloud_cover": {"gte": 0, "lt": 6}},
-            "intersects": {
-                "type": "Polygon",
-                "coordinates": [[
-                    [3.46, 44.90], [18.68, 44.90], [18.68, 53.71],
-                    [3.46, 53.71], [3.46, 44.90]
-                ]]
-            }
+# GDAL sizes its block cache once per process, on first use, so it is set here rather than per band
+os.environ.setdefault("GDAL_CACHEMAX", str(gdal_cache_mb))
+
+# Retries of STAC requests and band reads
+max_retries = 5
+backoff_seconds = 2.0
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+def open_ledger(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS searches (year INTEGER PRIMARY KEY, n_features INTEGER, searched_at REAL);
+        CREATE TABLE IF NOT EXISTS features (year INTEGER, id TEXT, feature TEXT, PRIMARY KEY (year, id));
+        CREATE TABLE IF NOT EXISTS processed (
+            year INTEGER, tile_id TEXT, band TEXT, output_path TEXT, processed_at REAL,
+            PRIMARY KEY (year, tile_id, band)
+        );
+    """)
+    if os.path.exists(processed_tiles_path) and not db.execute("SELECT 1 FROM processed LIMIT 1").fetchone():
+        with open(processed_tiles_path, 'rb') as f:
+            db.executemany("INSERT OR IGNORE INTO processed (year, tile_id, band) VALUES (?, ?, ?)", pickle.load(f))
+    db.commit()
+    return db
+
+
+def is_processed(db, year, tile_id, band):
+    return db.execute(
+        "SELECT 1 FROM processed WHERE year = ? AND tile_id = ? AND band = ?", (year, tile_id, band)
+    ).fetchone() is not None
+
+
+def mark_processed(db, year, tile_id, band, output_path):
+    db.execute("INSERT OR IGNORE INTO processed VALUES (?, ?, ?, ?, ?)", (year, tile_id, band, output_path, time.time()))
+    db.commit()
+
+
+def backoff(attempt):
+    return backoff_seconds * 2 ** attempt * (0.5 + random.random())
+
+
+async def request_json(session, url, query=None):
+    """POST ``query`` (or GET a next-page link), retrying throttling and server errors with backoff."""
+    for attempt in range(max_retries):
+        last_attempt = attempt == max_retries - 1
+        try:
+            request = session.post(url, json=query) if query is not None else session.get(url)
+            async with request as response:
+                if response.status not in retry_statuses or last_attempt:
+                    response.raise_for_status()
+                    return await response.json()
+                print(f"Request to {url} returned {response.status}, retrying")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if last_attempt:
+                raise
+            print(f"Request to {url} failed ({e!r}), retrying")
+        await asyncio.sleep(backoff(attempt))
+
+
+async def search_year(session, year):
+    """All STAC features of one year, following the ``next`` links."""
+    query = {
+        "collections": ["sentinel-2-l2a"],
+        "datetime": f"{year}-05-01T00:00:00Z/{year}-06-01T23:59:59Z",
+        "limit": 1000,
+        "query": {"eo:cloud_cover": {"gte": 0, "lt": 6}},
+        "intersects": {
+            "type": "Polygon",
+            "coordinates": [[
+                [3.46, 44.90], [18.68, 44.90], [18.68, 53.71],
+                [3.46, 53.71], [3.46, 44.90]
+            ]]
         }
+    }
+    features = []
+    data = await request_json(session, BASE_URL, query)
+    while True:
+        features.extend(data.get("features", []))
+        next_url = next((link["href"] for link in data.get("links", []) if link.get("rel") == "next"), None)
+        if not next_url:
+            return features
+        data = await request_json(session, next_url)
 
-        next_url = BASE_URL
-        while next_url:
-            try:
-                response = requests.post(next_url, json=query) if next_url == BASE_URL else requests.get(next_url)
-                response.raise_for_status()
-                data = response.json()
-                all_features.extend(data.get("features", []))
-                next_url = next((link["href"] for link in data.get("links", []) if link.get("rel") == "next"), None)
-            except requests.HTTPError as e:
-                print(f"Request failed: {e}")
-                break
-
-        with open(pickle_path, 'wb') as f:
-            pickle.dump(all_features, f)
-        print(f"Saved features for {year}")
-
-    if not all_features:
-        print(f"No data for {year}, skipping...")
-        continue
-
-    # Select the largest scene per tile
+
+async def load_features(db, session, year):
+    """Features of a year from the ledger, or searched and recorded there."""
+    if db.execute("SELECT 1 FROM searches WHERE year = ?", (year,)).fetchone():
+        print(f"Loading saved features for {year}")
+        return [json.loads(row[0]) for row in db.execute("SELECT feature FROM features WHERE year = ?", (year,))]
+
+    print(f"Fetching new data for {year}...")
+    try:
+        features = await search_year(session, year)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Request failed: {e!r}")
+        return []
+    db.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?)",
+                   [(year, f.get("id", ""), json.dumps(f)) for f in features])
+    db.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?)", (year, len(features), time.time()))
+    db.commit()
+    print(f"Saved features for {year}")
+    return features
+
+
+def select_scenes(features):
+    """Largest scene per tile."""
     scenes = {}
-    for feature in all_features:
+    for feature in features:
         assets = feature.get("assets", {})
         tile_id = feature.get("id", "").split('_')[-2]
         total_size = sum(assets[band].get('file:size', 0) for band in bands if band in assets)
         if tile_id and (tile_id not in scenes or scenes[tile_id]['size'] < total_size):
             scenes[tile_id] = {'assets': assets, 'size': total_size}
+    return scenes
+
+
+def process_band(band, href, year, tile_id):
+    """Reproject one band to an EPSG:3035 Cloud-Optimized GeoTIFF; returns the output path."""
+    start_time = time.time()
 
-    if not scenes:
-        print(f"No valid scenes for {year}, skipping.")
-        continue
+    filename = href.split('/')[-1].replace('.jp2', '_EPSG3035.tif')
+    output_dir = f"{output_root}/{year}/{band}"
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = f"{output_dir}/{filename}"
 
-    def process_band(band, href, year, tile_id):
-        start_time = time.time()
+    if os.path.exists(output_path):
+        print(f"File {output_path} exists, skipping.")
+        return output_path
 
-        if (year, tile_id, band) in processed_tiles:
-            print(f"Skipping {year}, {tile_id}, {band}")
-            return
+    # Warp destination block by block into a tiled GeoTIFF (the warper reads only the
+    # source pixels each block needs), then copy it to a COG with internal overviews.
+    # Both are written under temporary names so an interrupted band is never mistaken for a finished one.
+    tiled_path = output_path + ".tiled.tif"
+    partial_path = output_path + ".part"
+    try:
+        with rasterio.Env(GDAL_NUM_THREADS=warp_threads):
+            with rasterio.open(f'/vsis3/{href[5:]}') as src:
+                transform, width, height = calculate_default_transform(
+                    src.crs, output_crs, src.width, src.height, *src.bounds
+                )
 
-        filename = href.split('/')[-1].replace('.jp2', '_EPSG3035.tif')
-        output_dir = f"/path/to/{year}/{band}"
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = f"{output_dir}/{filename}"
+                kwargs = src.meta.copy()
+                kwargs.update({
+                    'crs': output_crs, 'transform': transform,
+                    'width': width, 'height': height,
+                    'driver': 'GTiff', 'compress': 'LZW',
+                    'tiled': True, 'blockxsize': cog_blocksize, 'blockysize': cog_blocksize
+                })
 
-        if os.path.exists(output_path):
-            print(f"File {output_path} exists, skipping.")
-            return
+                with rasterio.open(tiled_path, 'w', **kwargs) as dst:
+                    for _, window in dst.block_windows(1):
+                        block = np.zeros((window.height, window.width), dtype=dst.dtypes[0])
+                        reproject(
+                            source=rasterio.band(src, 1),
+                            destination=block,
+                            src_transform=src.transform,
+                            src_crs=src.crs,
+                            dst_transform=dst.window_transform(window),
+                            dst_crs=output_crs,
+                            dst_nodata=src.nodata,
+                            resampling=Resampling.nearest,
+                            num_threads=warp_threads
+                        )
+                        dst.write(block, 1, window=window)
 
-        with rasterio.open(f'/vsis3/{href[5:]}') as src:
-            transform, width, height = calculate_default_transform(
-                src.crs, output_crs, src.width, src.height, *src.bounds
+            rasterio.shutil.copy(
+                tiled_path, partial_path, driver='COG', compress='LZW', blocksize=cog_blocksize,
+                overview_resampling='NEAREST', num_threads=warp_threads
             )
+        os.replace(partial_path, output_path)
+    finally:
+        # Never leave the temporaries of a failed band behind
+        for path in (tiled_path, partial_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f"Processed {year}, {tile_id}, {band} in {time.time() - start_time:.2f}s")
+    return output_path
+
+
+async def process_band_async(db, inventory, executor, host_limits, band, href, year, tile_id):
+    """Run ``process_band`` in the thread pool, limited per S3 host and retried with backoff."""
+    if is_processed(db, year, tile_id, band):
+        print(f"Skipping {year}, {tile_id}, {band}")
+        return
+
+    host = urlparse(href).netloc
+    limit = host_limits.setdefault(host, asyncio.Semaphore(per_host_limit))
+    loop = asyncio.get_running_loop()
+    for attempt in range(max_retries):
+        try:
+            async with limit:
+                output_path = await loop.run_in_executor(executor, process_band, band, href, year, tile_id)
+            break
+        except RasterioIOError:
+            # The last failure is reported with the other failed bands of the tile
+            if attempt == max_retries - 1:
+                raise
+            await asyncio.sleep(backoff(attempt))
+
+    # Only the event loop thread writes to the ledger and the inventory
+    row = await loop.run_in_executor(executor, raster_inventory.describe, output_path, tile_id, year, band)
+    raster_inventory.record(inventory, [row])
+    mark_processed(db, year, tile_id, band, output_path)
+
+
+async def main():
+    db = open_ledger(ledger_path)
+    inventory = raster_inventory.open_inventory(inventory_path)
+    connector = aiohttp.TCPConnector(limit=stac_connections, limit_per_host=stac_connections)
+    host_limits = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=band_workers) as executor:
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as session:
+            # Search every year concurrently, then process all their bands in one pool
+            all_features = await asyncio.gather(*(load_features(db, session, year) for year in years))
+
+        tasks, keys = [], []
+        for year, features in zip(years, all_features):
+            if not features:
+                print(f"No data for {year}, skipping...")
+                continue
+
+            scenes = select_scenes(features)
+            if not scenes:
+                print(f"No valid scenes for {year}, skipping.")
+                continue
+
+            for tile_id, scene_data in scenes.items():
+                for band in bands:
+                    if band in scene_data["assets"] and scene_data["assets"][band]["href"].startswith("s3://"):
+                        href = scene_data["assets"][band]["href"]
+                        tasks.append(process_band_async(db, inventory, executor, host_limits, band, href, year, tile_id))
+                        keys.append((year, tile_id, band))
+
+        # A failing band must not cancel the others; failures are reported per tile at the end
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        failed = {}
+        for (year, tile_id, band), result in zip(keys, results):
+            if isinstance(result, Exception):
+                failed.setdefault((year, tile_id), []).append(f"{band}: {result!r}")
+        for (year, tile_id), errors in sorted(failed.items()):
+            print(f"Failed {year}, {tile_id}: {'; '.join(errors)}")
+
+    inventory.close()
+    db.close()
 
-            kwargs = src.meta.copy()
-            kwargs.update({
-                'crs': output_crs, 'transform': transform,
-                'width': width, 'height': height,
-                'driver': 'GTiff', 'compress': 'LZW'
-            })
-
-            with rasterio.open(output_path, 'w', **kwargs) as dst:
-                reproject(
-                    source=rasterio.band(src, 1),
-                    destination=rasterio.band(dst, 1),
-                    src_transform=src.transform,
-                    src_crs=src.crs,
-                    dst_transform=transform,
-                    dst_crs=output_crs,
-                    resampling=Resampling.nearest
-                )
 
-        print(f"Processed {year}, {tile_id}, {band} in {time.time() - start_time:.2f}s")
-        processed_tiles.add((year, tile_id, band))
-        with open(processed_tiles_path, 'wb') as f:
-            pickle.dump(processed_tiles, f)
-
-    # Process in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-        futures = [
-            executor.submit(process_band, band, assets[band]["href"], year, tile_id)
-            for tile_id, scene_data in scenes.items()
-            for band in bands if band in scene_data["assets"] and scene_data["assets"][band]["href"].startswith("s3://")
-        ]
-        concurrent.futures.wait(futures)
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,8 +4,9 @@
 @author: Alen Mangafić
 """
 import os
-import glob
 import subprocess
+import rasterio
+import raster_inventory
 
 # Base directory where Sentinel-2 data is stored
 base_dir = "/media/eouser/..."
@@ -19,18 +20,22 @@ common_extent = (3769660, 2336620, 5109780, 3489900)
 vrt_output_dir = os.path.join(base_dir, "vrt")
 os.makedirs(vrt_output_dir, exist_ok=True)
 
+# Tile inventory kept up to date by s2_fetch.py (run raster_inventory.py once to index an existing archive)
+db = raster_inventory.open_inventory(os.path.join(base_dir, "inventory.sqlite"))
+
 for band in bands:
-    all_rasters = []
-    for year in years:
-        band_dir = os.path.join(base_dir, str(year), band)
-        if os.path.exists(band_dir):
-            all_rasters.extend(glob.glob(os.path.join(band_dir, "*.tif")))
-    
+    all_rasters = raster_inventory.band_rasters(db, band, years)
+
     if not all_rasters:
         print(f"No rasters found for band {band}, skipping.")
         continue
 
+    # Pass the members as a list file; tens of thousands of paths overflow the command line
     vrt_path = os.path.join(vrt_output_dir, f"{band}.vrt")
+    list_path = os.path.join(vrt_output_dir, f"{band}_inputs.txt")
+    with open(list_path, "w") as f:
+        f.write("\n".join(all_rasters) + "\n")
+
     cmd = [
         "gdalbuildvrt",
         "-resolution", "user",
@@ -41,9 +46,15 @@ for band in bands:
         str(common_extent[2]),
         str(common_extent[3]),
         "-overwrite",
+        "-input_file_list", list_path,
         vrt_path
-    ] + all_rasters
+    ]
 
     print("Running command:", " ".join(cmd))
     subprocess.run(cmd, check=True)
-    print(f"Created VRT: {vrt_path}")
+    os.remove(list_path)
+
+    # Record what gdalbuildvrt produced, not what was requested
+    with rasterio.open(vrt_path) as src:
+        raster_inventory.record_vrt(db, vrt_path, band, tuple(src.bounds), src.res, len(all_rasters))
+    print(f"Created VRT: {vrt_path} from {len(all_rasters)} rasters")
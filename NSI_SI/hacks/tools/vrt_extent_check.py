@@ -5,8 +5,10 @@
 """
 import os
 import rasterio
+import raster_inventory
 
 bands_directory = "/media/eouser/.../s2/vrt"
+inventory_dir = "/media/eouser/..."
 
 # Gather all .vrt files
 vrt_files = [
@@ -15,10 +17,19 @@ vrt_files = [
     if f.endswith(".vrt")
 ]
 
+# Extents recorded by s2bands_to_yearly_vrt.py; only VRTs missing from the inventory are opened
+db = raster_inventory.open_inventory(os.path.join(inventory_dir, "inventory.sqlite"))
+recorded = raster_inventory.vrt_extents(db)
+
 extents = []
 for vrt_path in vrt_files:
-    with rasterio.open(vrt_path) as src:
-        extents.append((vrt_path, src.bounds))
+    real_path = os.path.realpath(vrt_path)
+    # Recorded extents are only trusted if the VRT has not changed since it was built
+    if real_path in recorded and os.path.getmtime(real_path) <= recorded[real_path][6]:
+        extents.append((vrt_path, recorded[real_path][:4]))
+    else:
+        with rasterio.open(vrt_path) as src:
+            extents.append((vrt_path, tuple(src.bounds)))
 
 # Check if all extents match
 unique_bounds = set(bounds for _, bounds in extents)
@@ -29,3 +40,9 @@ else:
     print("VRT files have DIFFERENT extents:")
     for path, bounds in extents:
         print(f"{path} → {bounds}")
+
+# Check that the member tiles of every band share a CRS and resolution
+for band in sorted({os.path.splitext(os.path.basename(path))[0] for path in vrt_files}):
+    grids = raster_inventory.raster_grids(db, band)
+    if len(grids) > 1:
+        print(f"{band} tiles are on {len(grids)} different grids (CRS, res_x, res_y, count): {grids}")
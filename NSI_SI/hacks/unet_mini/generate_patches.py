@@ -1,11 +1,67 @@
+import os
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.model_selection import train_test_split
 from grass.script import array as garray
 
-def generate_patches(feature_layers, label_layer, patch_size, overlap, split_ratios, binary_labels=False):
-    print(f"Loading features: {feature_layers}")
-    features = np.stack([garray.array(layer)[:] for layer in feature_layers], axis=-1)
 
+def patch_index(labels, patch_size, overlap, binary_labels=False, block_rows=64):
+    """Offsets and stratification keys of the patches holding more than one class.
+
+    Every patch position is checked in bulk on a strided view of the labels
+    (no copies), ``block_rows`` rows of patches at a time. The key is the
+    mean label of the patch.
+    """
+    step = patch_size - overlap
+    if binary_labels:
+        labels = (labels > 0).astype(np.uint8)
+    # Same positions as range(0, size - patch_size, step) along each axis
+    ys = np.arange(0, labels.shape[0] - patch_size, step)
+    xs = np.arange(0, labels.shape[1] - patch_size, step)
+    if not len(ys) or not len(xs):
+        return np.empty((0, 2), dtype=np.int64), np.empty(0)
+    windows = sliding_window_view(labels, (patch_size, patch_size))
+
+    offsets, keys = [], []
+    for i in range(0, len(ys), block_rows):
+        block_ys = ys[i:i + block_rows]
+        # Basic slicing keeps this a view of (rows, cols, patch, patch) windows
+        block = windows[block_ys[0]:block_ys[-1] + 1:step, :xs[-1] + 1:step]
+        accepted = np.nonzero(block.min(axis=(2, 3)) != block.max(axis=(2, 3)))
+        offsets.append(np.column_stack([block_ys[accepted[0]], xs[accepted[1]]]))
+        keys.append(block.mean(axis=(2, 3))[accepted])
+    return np.concatenate(offsets), np.concatenate(keys)
+
+
+def save_patch_index(path, offsets, keys, patch_size, overlap, label_layer, binary_labels):
+    with open(path, "wb") as f:
+        np.savez(f, offsets=offsets.astype(np.int32), keys=keys.astype(np.float32), patch_size=patch_size,
+                 overlap=overlap, label_layer=label_layer, binary_labels=binary_labels)
+
+
+def load_patch_index(path, patch_size, overlap, label_layer, binary_labels):
+    """(offsets, keys) of a saved index, or None if missing or built with other settings."""
+    if not os.path.exists(path):
+        return None
+    index = np.load(path)
+    if (int(index["patch_size"]) != patch_size or int(index["overlap"]) != overlap
+            or str(index["label_layer"]) != label_layer or bool(index["binary_labels"]) != binary_labels):
+        return None
+    return index["offsets"].astype(np.int64), index["keys"]
+
+
+def extract_patches(array, offsets, patch_size):
+    """(n, patch, patch) copies of the patches of a 2D ``array`` at ``offsets``."""
+    return sliding_window_view(array, (patch_size, patch_size))[offsets[:, 0], offsets[:, 1]]
+
+
+def generate_patches(feature_layers, label_layer, patch_size, overlap, split_ratios, binary_labels=False,
+                     index_path=None):
+    """Train/valid patches with more than one label class.
+
+    With ``index_path`` the accepted patch offsets and stratification keys are
+    saved there and reused by later runs instead of rescanning the labels.
+    """
     try:
         labels = garray.array(label_layer)[:].astype(np.int32)
     except Exception as e:
@@ -16,27 +72,29 @@ def generate_patches(feature_layers, label_layer, patch_size, overlap, split_rat
         print("Label array is empty.")
         return None
 
-    patches, label_patches = [], []
-    for y in range(0, labels.shape[0] - patch_size, patch_size - overlap):
-        for x in range(0, labels.shape[1] - patch_size, patch_size - overlap):
-            patch = features[y:y + patch_size, x:x + patch_size, :]
-            label_patch = labels[y:y + patch_size, x:x + patch_size]
-
-            if binary_labels:
-                label_patch = (label_patch > 0).astype(np.uint8)
+    index = load_patch_index(index_path, patch_size, overlap, label_layer, binary_labels) if index_path else None
+    if index is None:
+        offsets, keys = patch_index(labels, patch_size, overlap, binary_labels)
+        if index_path:
+            save_patch_index(index_path, offsets, keys, patch_size, overlap, label_layer, binary_labels)
+    else:
+        print(f"Using patch index {index_path}")
+        offsets, keys = index
 
-            if len(np.unique(label_patch)) > 1:
-                patches.append(patch)
-                label_patches.append(label_patch)
-
-    patches, label_patches = np.array(patches), np.array(label_patches)
-    if len(patches) == 0:
+    if len(offsets) == 0:
         print("No valid patches found.")
         return None
 
+    # Gather the accepted patches layer by layer instead of stacking whole rasters
+    print(f"Loading features: {feature_layers}")
+    patches = np.stack([extract_patches(garray.array(layer)[:], offsets, patch_size) for layer in feature_layers],
+                       axis=-1)
+    label_patches = extract_patches(labels, offsets, patch_size)
+    if binary_labels:
+        label_patches = (label_patches > 0).astype(np.uint8)
+
     train_x, valid_x, train_y, valid_y = train_test_split(
-        patches, label_patches, test_size=split_ratios[1], stratify=[p.flatten().mean() for p in label_patches]
+        patches, label_patches, test_size=split_ratios[1], stratify=keys
     )
 
     return {"train": (train_x, train_y), "valid": (valid_x, valid_y), "label_name": "labels_2017"}
-
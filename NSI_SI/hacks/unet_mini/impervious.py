@@ -1,8 +1,7 @@
 import os
-import h5py
-import numpy as np
 import time
 from tensorflow.keras.callbacks import ModelCheckpoint
+from tile_loader import tile_dataset
 from train_model import train_model
 from predict_patches import predict_and_export
 
@@ -28,44 +27,29 @@ predict_split = list(range(train_valid_row_limit // chunk_size, total_rows // ch
 os.makedirs(output_dir, exist_ok=True)
 os.makedirs(checkpoint_dir, exist_ok=True)
 
-def load_data_by_chunks(h5_file_path, feature_layers, chunk_indices):
-    """Load features and labels from HDF5 in chunks."""
-    with h5py.File(h5_file_path, "r") as h5file:
-        features, labels = [], []
-        for idx in chunk_indices:
-            row_start = idx * chunk_size
-            row_end = min(row_start + chunk_size, h5file["labels/labels_2017"].shape[0])
-
-            feature_chunk = np.stack([
-                np.pad(
-                    h5file[f"/features/{layer}"][row_start:row_end, :chunk_size],
-                    ((0, chunk_size - (row_end - row_start)), (0, 0)),
-                    mode="constant"
-                ) for layer in feature_layers
-            ], axis=-1)
-
-            label_chunk = np.pad(
-                h5file["labels/labels_2017"][row_start:row_end, :chunk_size],
-                ((0, chunk_size - (row_end - row_start)), (0, 0)),
-                mode="constant"
-            )
-
-            features.append(feature_chunk)
-            labels.append(label_chunk)
-
-    return np.array(features), np.array(labels)
+def load_data_by_chunks(h5_file_path, feature_layers, chunk_indices, shuffle=False):
+    """Stream full-width features and labels tiles of the given row chunks from HDF5."""
+    return tile_dataset(
+        h5_file_path,
+        [f"/features/{layer}" for layer in feature_layers],
+        "labels/labels_2017",
+        chunk_indices,
+        batch_size,
+        tile_size=chunk_size,
+        shuffle=shuffle,
+    )
 
 models = [('model1', ['B04_20m.vrt', 'B11_20m.vrt', 'B12_20m.vrt'])]
 
 for model_name, feature_layers in models:
     print(f"Processing {model_name}")
     
-    train_features, train_labels = load_data_by_chunks(h5_file_path, feature_layers, train_split)
-    valid_features, valid_labels = load_data_by_chunks(h5_file_path, feature_layers, valid_split)
+    train_tiles = load_data_by_chunks(h5_file_path, feature_layers, train_split, shuffle=True)
+    valid_tiles = load_data_by_chunks(h5_file_path, feature_layers, valid_split)
 
     train_model(
         model_name=model_name,
-        patches={"train": (train_features, train_labels), "valid": (valid_features, valid_labels)},
+        patches={"train": train_tiles, "valid": valid_tiles},
         num_classes=3,
         output_dir=output_dir,
         batch_size=batch_size,
@@ -1,9 +1,13 @@
 import os
 import sys
 import numpy as np
-import h5py
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
 from pathlib import Path
 from tensorflow.keras.models import load_model
+from tile_loader import H5TileReader, prefetch
 import subprocess
 
 # GRASS GIS Configuration
@@ -16,64 +20,108 @@ sys.path.append(subprocess.check_output(["grass", "--config", "python_path"], te
 
 import grass.script as gs
 import grass.jupyter as gj
-import grass.script.array as garray
 
 # GRASS GIS Database Configuration
 gisdbase = Path("/path/to/grass_baza/")
 session = gj.init(Path(gisdbase, "some_project"))
 os.environ['GRASS_OVERWRITE'] = '0'  # Overwriting not permitted, by default is 1, so do as you dare
 
-def predict_and_export(model_path, h5_file_path, feature_layers, chunk_indices, output_layer, chunk_size):
+def check_overlap(tile_size, overlap):
+    """The tile stride (tile_size - overlap) has to be positive."""
+    if not 0 <= overlap < tile_size:
+        raise ValueError(f"overlap must be in [0, {tile_size}), got {overlap}")
+
+
+def blend_weights(tile_size, overlap):
+    """(tile, tile) weights ramping down over the overlap, so overlapping tiles blend without seams."""
+    check_overlap(tile_size, overlap)
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(overlap, dtype=np.float32) + 0.5) / overlap
+        ramp[:overlap] = np.minimum(ramp[:overlap], edge)
+        ramp[-overlap:] = np.minimum(ramp[-overlap:], edge[::-1])
+    return np.outer(ramp, ramp)
+
+
+def tile_batches(reader, offsets, batch_size, n_features):
+    """Yield (offsets, features) batches of tiles; the batches span chunk rows."""
+    for i in range(0, len(offsets), batch_size):
+        batch = offsets[i:i + batch_size]
+        yield batch, np.stack([reader.read_stack(row, col, range(n_features)) for row, col in batch])
+
+
+def grass_geotiff_profile(n_rows, n_cols, chunk_size):
+    """GeoTIFF profile georeferenced on the current GRASS region."""
+    region = gs.region()
+    return {
+        "driver": "GTiff", "dtype": "uint8", "count": 1, "height": n_rows, "width": n_cols,
+        "crs": CRS.from_wkt(gs.read_command("g.proj", flags="wf")),
+        "transform": from_origin(region["w"], region["n"], region["ewres"], region["nsres"]),
+        "tiled": True, "blockxsize": chunk_size, "blockysize": chunk_size, "compress": "deflate",
+        "BIGTIFF": "IF_SAFER",
+    }
+
+
+def predict_and_export(model_path, h5_file_path, feature_layers, chunk_indices, output_layer, chunk_size,
+                       batch_size=32, overlap=32, output_path=None, prefetch_depth=4):
+    """Predict the given row chunks tile by tile and stream the classes to a GeoTIFF.
+
+    Tiles of ``chunk_size`` overlap by ``overlap`` pixels and their class
+    probabilities are blended; only a band of ``chunk_size`` rows of
+    probabilities is kept in memory, and finished rows are written as soon as
+    no later tile touches them. The GeoTIFF is imported into GRASS GIS as
+    ``output_layer`` at the end.
+    """
+    check_overlap(chunk_size, overlap)
     print(f"Loading model from {model_path}")
     model = load_model(model_path)
-
-    with h5py.File(h5_file_path, "r") as h5file:
-        n_rows, n_cols = h5file[f"/features/{feature_layers[0]}"].shape
-
-    predictions = np.zeros((n_rows, n_cols), dtype=np.uint8)
-
-    print(f"Processing {len(chunk_indices)} chunks...")
-    for chunk_idx in chunk_indices:
-        row_start = chunk_idx * chunk_size
-        row_end = min(row_start + chunk_size, n_rows)
-
-        chunk_features = []
-        with h5py.File(h5_file_path, "r") as h5file:
-            for col_start in range(0, n_cols, chunk_size):
-                col_end = min(col_start + chunk_size, n_cols)
-
-                tile = []
-                for layer in feature_layers:
-                    layer_data = h5file[f"/features/{layer}"][row_start:row_end, col_start:col_end]
-                    if layer_data.shape != (chunk_size, chunk_size):
-                        layer_data = np.pad(
-                            layer_data,
-                            ((0, chunk_size - layer_data.shape[0]), (0, chunk_size - layer_data.shape[1])),
-                            mode="constant",
-                        )
-                    tile.append(layer_data)
-                chunk_features.append(np.stack(tile, axis=-1))
-
-        X_test = np.array(chunk_features)
-
-        print(f"Predicting chunk {chunk_idx + 1}/{len(chunk_indices)}...")
-        predictions_chunk = model.predict(X_test)
-
-        if predictions_chunk.shape[-1] > 1:
-            predictions_chunk = np.argmax(predictions_chunk, axis=-1)
-        else:
-            predictions_chunk = (predictions_chunk > 0.5).astype(np.uint8)
-
-        for i, col_start in enumerate(range(0, n_cols, chunk_size)):
-            col_end = min(col_start + chunk_size, n_cols)
-            predictions[row_start:row_end, col_start:col_end] = predictions_chunk[i, :row_end - row_start, :col_end - col_start]
-
-    print(f"Finished predictions. Writing to GRASS GIS layer: {output_layer}")
-    write_raster_grass(predictions, output_layer)
-
-def write_raster_grass(array, output_name):
-    out_raster = garray.array()
-    out_raster[...] = array
-    out_raster.write(output_name, overwrite=True)
-    print(f"Raster written to GRASS GIS as: {output_name}")
-
+    output_path = output_path or f"{output_layer}.tif"
+    stride = chunk_size - overlap
+    weights = blend_weights(chunk_size, overlap)[..., None]
+
+    layers = [f"/features/{layer}" for layer in feature_layers]
+    with H5TileReader(h5_file_path, layers, chunk_size) as reader, \
+            rasterio.open(output_path, "w", **grass_geotiff_profile(*reader.shape, chunk_size)) as dst:
+        n_rows, n_cols = reader.shape
+        row_start = min(chunk_indices) * chunk_size
+        row_end = min((max(chunk_indices) + 1) * chunk_size, n_rows)
+        offsets = [(row, col) for row in range(row_start, row_end, stride) for col in range(0, n_cols, stride)]
+
+        # Blended probabilities and weight sums of the rows [band_start, band_start + chunk_size)
+        band_start = row_start
+        probs, weight_sum = None, np.zeros((chunk_size, n_cols, 1), dtype=np.float32)
+
+        def flush(rows):
+            # Write the first ``rows`` rows of the band and shift the band down
+            nonlocal band_start
+            rows = min(rows, row_end - band_start)
+            if rows > 0:
+                blended = probs[:rows] / np.maximum(weight_sum[:rows], 1e-6)
+                classes = np.argmax(blended, axis=-1) if blended.shape[-1] > 1 else blended[..., 0] > 0.5
+                dst.write(classes.astype(np.uint8), 1, window=Window(0, band_start, n_cols, rows))
+            probs[:-stride], weight_sum[:-stride] = probs[stride:], weight_sum[stride:]
+            probs[-stride:], weight_sum[-stride:] = 0, 0
+            band_start += stride
+
+        print(f"Processing {len(offsets)} tiles in batches of {batch_size}...")
+        batches = prefetch(tile_batches(reader, offsets, batch_size, len(layers)), prefetch_depth)
+        for n_batch, (batch, X_test) in enumerate(batches):
+            predictions_batch = model.predict_on_batch(X_test)
+            if probs is None:
+                probs = np.zeros((chunk_size, n_cols, predictions_batch.shape[-1]), dtype=np.float32)
+
+            for (row, col), prediction in zip(batch, predictions_batch):
+                while row >= band_start + stride:
+                    flush(stride)
+                width = min(chunk_size, n_cols - col)
+                probs[:, col:col + width] += (prediction * weights)[:, :width]
+                weight_sum[:, col:col + width] += weights[:, :width]
+
+            if n_batch % 100 == 0:
+                print(f"Predicted rows up to {band_start}/{row_end}")
+
+        while band_start < row_end:
+            flush(stride)
+
+    print(f"Finished predictions. Importing {output_path} to GRASS GIS layer: {output_layer}")
+    gs.run_command("r.in.gdal", input=output_path, output=output_layer, overwrite=True)
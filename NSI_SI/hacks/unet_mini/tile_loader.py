@@ -0,0 +1,164 @@
+import queue
+import threading
+from collections import OrderedDict
+import h5py
+import numpy as np
+
+
+class H5TileReader:
+    """Reads (tile, tile) windows of several ard.h5 layers through an LRU of decompressed chunks.
+
+    Tiles are aligned to the HDF5 chunk grid, so every chunk is decompressed
+    once while it stays in the cache, even when tiles and chunks differ in size.
+    Windows reaching past the raster edge are zero-padded.
+    """
+
+    def __init__(self, h5_file_path, layers, tile_size=256, cache_chunks=256):
+        self.h5file = h5py.File(h5_file_path, "r")
+        self.datasets = [self.h5file[layer] for layer in layers]
+        self.shape = self.datasets[0].shape
+        self.chunks = self.datasets[0].chunks or (tile_size, tile_size)
+        self.tile_size = tile_size
+        self.cache_chunks = cache_chunks
+        self._cache = OrderedDict()
+
+    def close(self):
+        self._cache.clear()
+        self.h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _chunk(self, i, chunk_row, chunk_col):
+        key = (i, chunk_row, chunk_col)
+        block = self._cache.get(key)
+        if block is not None:
+            self._cache.move_to_end(key)
+            return block
+        ch, cw = self.chunks
+        block = self.datasets[i][chunk_row * ch:(chunk_row + 1) * ch, chunk_col * cw:(chunk_col + 1) * cw]
+        self._cache[key] = block
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return block
+
+    def read(self, i, row, col, height=None, width=None):
+        """(height, width) window of layer ``i`` at (row, col), zero-padded past the edge."""
+        height = height or self.tile_size
+        width = width or self.tile_size
+        out = np.zeros((height, width), dtype=self.datasets[i].dtype)
+        n_rows, n_cols = self.shape
+        ch, cw = self.chunks
+        if row >= n_rows or col >= n_cols:
+            return out
+        row_end, col_end = min(row + height, n_rows), min(col + width, n_cols)
+        for chunk_row in range(row // ch, (row_end - 1) // ch + 1):
+            for chunk_col in range(col // cw, (col_end - 1) // cw + 1):
+                block = self._chunk(i, chunk_row, chunk_col)
+                r0, c0 = chunk_row * ch, chunk_col * cw
+                r_from, r_to = max(row, r0), min(row_end, r0 + block.shape[0])
+                c_from, c_to = max(col, c0), min(col_end, c0 + block.shape[1])
+                out[r_from - row:r_to - row, c_from - col:c_to - col] = block[r_from - r0:r_to - r0, c_from - c0:c_to - c0]
+        return out
+
+    def read_stack(self, row, col, layers=None, height=None, width=None):
+        """(height, width, layers) window of several layers at (row, col)."""
+        layers = range(len(self.datasets)) if layers is None else layers
+        return np.stack([self.read(i, row, col, height, width) for i in layers], axis=-1)
+
+
+def tile_offsets(shape, tile_size, chunk_rows):
+    """(row, col) of every full-width tile in the given row bands (in tile_size units)."""
+    n_rows, n_cols = shape
+    return [(idx * tile_size, col) for idx in chunk_rows if idx * tile_size < n_rows
+            for col in range(0, n_cols, tile_size)]
+
+
+def tile_generator(h5_file_path, feature_layers, label_layer, offsets, tile_size=256,
+                   shuffle=False, seed=None, cache_chunks=256):
+    """Yield (features, labels) tiles at ``offsets`` from one open ard.h5 handle."""
+    offsets = list(offsets)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(offsets)
+    with H5TileReader(h5_file_path, list(feature_layers) + [label_layer], tile_size, cache_chunks) as reader:
+        n_features = len(feature_layers)
+        for row, col in offsets:
+            features = reader.read_stack(row, col, range(n_features)).astype(np.float32)
+            labels = reader.read(n_features, row, col)
+            yield features, labels
+
+
+def prefetch(generator, depth=16):
+    """Run ``generator`` in a background thread, keeping up to ``depth`` items ready.
+
+    If the consumer stops early the worker stops as well and closes ``generator``.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up once the consumer is gone instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in generator:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            generator.close()
+        put(done)
+
+    threading.Thread(target=worker, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def tile_dataset(h5_file_path, feature_layers, label_layer, chunk_rows, batch_size, tile_size=256,
+                 shuffle=False, prefetch_depth=16, cache_chunks=256):
+    """Batched tf.data.Dataset of full-width tiles streamed from ard.h5.
+
+    Only ``prefetch_depth`` tiles, the batches and ``cache_chunks`` decompressed
+    chunks are held in memory; with ``shuffle`` the tile order changes every epoch.
+    """
+    import tensorflow as tf
+
+    with h5py.File(h5_file_path, "r") as h5file:
+        shape = h5file[label_layer].shape
+        label_dtype = h5file[label_layer].dtype
+    offsets = tile_offsets(shape, tile_size, chunk_rows)
+    epoch = [0]
+
+    def generator():
+        epoch[0] += 1
+        return prefetch(tile_generator(h5_file_path, feature_layers, label_layer, offsets, tile_size,
+                                       shuffle, epoch[0], cache_chunks), prefetch_depth)
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec((tile_size, tile_size, len(feature_layers)), tf.float32),
+            tf.TensorSpec((tile_size, tile_size), tf.as_dtype(label_dtype)),
+        ),
+    )
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
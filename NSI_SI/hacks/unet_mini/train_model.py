@@ -1,4 +1,5 @@
 import os
+import tensorflow as tf
 from tensorflow.keras.callbacks import ModelCheckpoint
 from unet_mini import UNet
 
@@ -7,12 +8,16 @@ def train_model(model_name, patches, num_classes, output_dir, batch_size, epochs
     if "train" not in patches or "valid" not in patches:
         raise ValueError("Patches dictionary must contain 'train' and 'valid' keys.")
 
-    # Extract train and validation data
-    X_train, y_train = patches["train"]
-    X_valid, y_valid = patches["valid"]
+    # Batched tf.data datasets (streamed tiles) are passed to fit() as they are
+    streamed = isinstance(patches["train"], tf.data.Dataset)
 
     # Get input shape based on feature layers
-    input_shape = X_train.shape[1:]  # Automatically determine input shape
+    if streamed:
+        input_shape = tuple(patches["train"].element_spec[0].shape[1:])
+    else:
+        X_train, y_train = patches["train"]
+        X_valid, y_valid = patches["valid"]
+        input_shape = X_train.shape[1:]  # Automatically determine input shape
 
     # Initialize UNet model
     model = UNet(input_shape, num_classes)
@@ -37,15 +42,24 @@ def train_model(model_name, patches, num_classes, output_dir, batch_size, epochs
     callbacks.append(checkpoint)
 
     # Train the model
-    model.fit(
-        X_train,
-        y_train,
-        validation_data=(X_valid, y_valid),
-        epochs=epochs,
-        batch_size=batch_size,
-        callbacks=callbacks,
-        verbose=verbose,
-    )
+    if streamed:
+        model.fit(
+            patches["train"],
+            validation_data=patches["valid"],
+            epochs=epochs,
+            callbacks=callbacks,
+            verbose=verbose,
+        )
+    else:
+        model.fit(
+            X_train,
+            y_train,
+            validation_data=(X_valid, y_valid),
+            epochs=epochs,
+            batch_size=batch_size,
+            callbacks=callbacks,
+            verbose=verbose,
+        )
 
     # Save the final trained model
     final_model_path = os.path.join(output_dir, f"{model_name}_final.h5")